@@ -0,0 +1,98 @@
+"""PyDendro bulk reading of ring width files."""
+# Copyright (c) 2011, Matthew Emmett.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials provided
+#      with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+
+from collections import namedtuple
+
+from pydendro import rwl
+
+
+ReadResult = namedtuple('ReadResult', [ 'stack', 'path', 'samples', 'error' ])
+
+
+def stack_name(path):
+  """Return stack name for the file *path* (its basename sans extensions)."""
+
+  return os.path.basename(path).split('.')[0]
+
+
+def read(path, cache=False):
+  """Read RWL or CSV file (depending on extension) and return list of samples."""
+
+  if path.lower().endswith('.csv'):
+    from pydendro import csv
+    return csv.read(path, cache=cache)
+  return rwl.read(path, cache=cache)
+
+
+def _read(path, cache=False):
+  try:
+    return ReadResult(stack_name(path), path, read(path, cache=cache), None)
+  except Exception as e:
+    return ReadResult(stack_name(path), path, None, e)
+
+
+def read_many(paths, workers=None, cache=False):
+  """Read many RWL/CSV files in a pool of *workers* processes.
+
+  Yields one ReadResult per file as soon as it is ready (not
+  necessarily in the order of *paths*).  Errors are reported per file
+  through the error field instead of being raised, so that one bad
+  file does not stop the rest.  With workers=1 the files are read
+  in-process.  If *cache* is set, files are loaded through the on-disk
+  cache (see pydendro.cache).
+
+  Closing the generator early cancels the files that have not been
+  started yet.
+  """
+
+  paths = list(paths)
+
+  if workers == 1 or len(paths) <= 1:
+    for path in paths:
+      yield _read(path, cache)
+    return
+
+  # concurrent.futures needs the futures backport on Python 2
+  from concurrent.futures import ProcessPoolExecutor, as_completed
+
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    futures = { pool.submit(_read, path, cache): path for path in paths }
+    try:
+      for future in as_completed(futures):
+        path = futures[future]
+        try:
+          yield future.result()
+        except Exception as e:
+          yield ReadResult(stack_name(path), path, None, e)
+    finally:
+      # if the caller stops early, don't wait for files not yet started
+      for future in futures:
+        future.cancel()
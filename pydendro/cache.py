@@ -0,0 +1,156 @@
+"""PyDendro on-disk cache of parsed ring width files."""
+# Copyright (c) 2011, Matthew Emmett.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials provided
+#      with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import hashlib
+import os
+
+import numpy as np
+
+from tempfile import mkstemp
+
+from pydendro.sample import Sample
+
+
+# cache location and size bound (in bytes)
+directory = os.environ.get('PYDENDRO_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'pydendro'))
+max_size  = 256 * 1024 * 1024
+
+
+def _entry(filename, kind):
+  """Return cache entry path for *filename* parsed by reader *kind*.
+
+  Entries are keyed by the absolute path, size, modification time and
+  content hash of the file.
+  """
+
+  stat = os.stat(filename)
+
+  content = hashlib.sha1()
+  with open(filename, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      content.update(chunk)
+
+  key = '\0'.join([ os.path.abspath(filename), str(stat.st_size), repr(stat.st_mtime),
+                    content.hexdigest(), kind ])
+
+  return os.path.join(directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npz')
+
+
+def load(filename, kind):
+  """Return cached samples of *filename*, or None if not cached."""
+
+  entry = _entry(filename, kind)
+
+  try:
+    with np.load(entry, allow_pickle=False) as data:
+      widths  = data['widths']
+      offsets = data['offsets']
+      names   = data['names']
+      fyogs   = data['fyogs']
+  except (IOError, OSError, KeyError, ValueError):
+    return None
+
+  # mark as recently used
+  try:
+    os.utime(entry, None)
+  except OSError:
+    pass
+
+  return [ Sample(str(names[i]), int(fyogs[i]), widths[offsets[i]:offsets[i+1]])
+           for i in range(len(names)) ]
+
+
+def store(filename, kind, samples):
+  """Cache *samples* parsed from *filename* by reader *kind*."""
+
+  entry = _entry(filename, kind)
+
+  lengths = [ len(sample.widths) for sample in samples ]
+  widths  = np.concatenate([ np.asarray(sample.widths, dtype=np.float64) for sample in samples ]
+                           + [ np.zeros(0) ])
+  offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+  names   = np.array([ str(sample.name) for sample in samples ], dtype=np.str_)
+  fyogs   = np.array([ sample.fyog for sample in samples ], dtype=np.int64)
+
+  try:
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    fd, tmp = mkstemp(dir=directory, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        np.savez(f, widths=widths, offsets=offsets, names=names, fyogs=fyogs)
+      os.rename(tmp, entry)
+    except:
+      os.remove(tmp)
+      raise
+  except (IOError, OSError):
+    return
+
+  evict()
+
+
+def evict(size=None):
+  """Remove least recently used entries until the cache fits in *size* bytes."""
+
+  if size is None:
+    size = max_size
+
+  try:
+    entries = [ os.path.join(directory, x) for x in os.listdir(directory) if x.endswith('.npz') ]
+    entries = [ (os.stat(x), x) for x in entries ]
+  except OSError:
+    return
+
+  total = sum(stat.st_size for stat, _ in entries)
+  for stat, entry in sorted(entries, key=lambda x: x[0].st_mtime):
+    if total <= size:
+      break
+    try:
+      os.remove(entry)
+    except OSError:
+      pass
+    total -= stat.st_size
+
+
+def cached(reader, filename, kind):
+  """Return reader(filename), loading from or adding to the cache.
+
+  Sample names and first years come back as str and int either way,
+  whatever types the reader produced.
+  """
+
+  samples = load(filename, kind)
+  if samples is None:
+    samples = reader(filename)
+    for sample in samples:
+      sample.name = str(sample.name)
+      sample.fyog = sample.original_fyog = int(sample.fyog)
+    store(filename, kind, samples)
+
+  return samples
@@ -0,0 +1,246 @@
+"""PyDendro cross-dating by lagged correlation."""
+# Copyright (c) 2011, Matthew Emmett.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials provided
+#      with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from collections import namedtuple
+
+import numpy as np
+
+from pydendro.matrix import RingWidthMatrix
+from pydendro.sample import Sample
+
+
+CrossDate = namedtuple('CrossDate', [ 'shift', 'first_year', 'overlap', 'r', 't' ])
+
+Correlations = namedtuple('Correlations', [ 'names', 'overlap', 'r' ])
+
+
+def lag_scan(x, y, min_overlap=50):
+  """Correlate series *x* with series *y* at every lag.
+
+  At lag L, x[i] is paired with y[i+L], for L from -(len(x)-1) to
+  len(y)-1.  NaNs in either series are left out of the pairs.  The
+  sums of the Pearson correlation over the overlap of each lag (the
+  pair count, sums, sums of squares and cross products) are all
+  cross-correlations, which are computed with FFTs, so the cost is
+  O(n log n) for all lags together.
+
+  Returns (lags, overlap, r, t) arrays; r and t (the Student's t
+  value of r) are NaN where fewer than *min_overlap* pairs overlap.
+  """
+
+  x = np.asarray(x, dtype=np.float64)
+  y = np.asarray(y, dtype=np.float64)
+  n, m = len(x), len(y)
+
+  wx = (~np.isnan(x)).astype(np.float64)
+  wy = (~np.isnan(y)).astype(np.float64)
+  x  = np.where(wx > 0, x, 0.0)
+  y  = np.where(wy > 0, y, 0.0)
+
+  size = 1
+  while size < n + m - 1:
+    size *= 2
+
+  # subtracting the means keeps the sums of squares well conditioned
+  x = np.where(wx > 0, x - x.sum() / max(wx.sum(), 1), 0.0)
+  y = np.where(wy > 0, y - y.sum() / max(wy.sum(), 1), 0.0)
+
+  fwx, fwy = np.fft.rfft(wx, size), np.fft.rfft(wy, size)
+  fx,  fy  = np.fft.rfft(x, size),  np.fft.rfft(y, size)
+  fxx, fyy = np.fft.rfft(x*x, size), np.fft.rfft(y*y, size)
+
+  def xcorr(fa, fb):
+    return np.fft.irfft(np.conj(fa) * fb, size)
+
+  lags = np.arange(-(n-1), m)
+  idx  = lags % size
+
+  count = np.rint(xcorr(fwx, fwy)[idx])
+  sx    = xcorr(fx, fwy)[idx]
+  sy    = xcorr(fwx, fy)[idx]
+  sxx   = xcorr(fxx, fwy)[idx]
+  syy   = xcorr(fwx, fyy)[idx]
+  sxy   = xcorr(fx, fy)[idx]
+
+  with np.errstate(invalid='ignore', divide='ignore'):
+    cov = count*sxy - sx*sy
+    vx  = count*sxx - sx*sx
+    vy  = count*syy - sy*sy
+    r   = cov / np.sqrt(vx*vy)
+    r   = np.where((count >= max(min_overlap, 3)) & (vx > 0) & (vy > 0), np.clip(r, -1, 1), np.nan)
+    t   = r * np.sqrt((count - 2) / (1 - r*r))
+
+  return lags, count.astype(np.int64), r, t
+
+
+def crossdate(sample, reference, min_overlap=50, normalization=None):
+  """Rank the possible positions of *sample* against *reference*.
+
+  Both are samples (eg, a sample and a master chronology).  If
+  *normalization* is given (see pydendro.normalize) the sample is
+  normalized first; the reference should be normalized the same way
+  (see chronology).  Returns a list of CrossDate tuples, best (highest
+  t value) first, giving the shift to apply to the sample, the first
+  year it would then have, the number of overlapping years and the
+  correlation and t values.
+  """
+
+  x, fx = sample.widths, sample.fyog
+  y, fy = reference.widths, reference.fyog
+
+  if normalization is not None:
+    x = np.asarray(normalization(x), dtype=np.float64)
+    fx = sample.lyog - len(x) + 1
+
+  lags, overlap, r, t = lag_scan(x, y, min_overlap)
+
+  # x[0] is in year fx and moves to year fy + lag
+  shifts = fy + lags - fx
+  order  = [ i for i in np.argsort(-t, kind='stable') if not np.isnan(t[i]) ]
+
+  return [ CrossDate(int(shifts[i]), int(sample.fyog + shifts[i]),
+                     int(overlap[i]), float(r[i]), float(t[i])) for i in order ]
+
+
+def chronology(samples, normalization=None, name='chronology'):
+  """Return the mean chronology of *samples* as a sample.
+
+  If *normalization* is given, samples are normalized before they are
+  averaged.
+  """
+
+  matrix = RingWidthMatrix(samples)
+  data = matrix.data if normalization is None else matrix.normalized(normalization)
+
+  count = np.count_nonzero(~np.isnan(data), axis=1)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    mean = np.where(count > 0, np.nansum(data, axis=1) / np.maximum(count, 1), np.nan)
+
+  return Sample(name, matrix.first_year, mean)
+
+
+##
+## all pairs
+##
+
+def pair_index(i, j, n):
+  """Index of the pair (i, j), i < j, of *n* series in condensed arrays."""
+
+  return n*i - i*(i+1)//2 + (j - i - 1)
+
+
+def squareform(condensed, n, diagonal=0):
+  """Expand the *condensed* pair values of *n* series to a symmetric matrix."""
+
+  square = np.full((n, n), diagonal, dtype=np.asarray(condensed).dtype)
+  i, j = np.triu_indices(n, 1)
+  square[i, j] = condensed
+  square[j, i] = condensed
+  return square
+
+
+def _pair_block(x, y):
+  """Return the overlap counts and correlations of the columns of *x* and *y*.
+
+  Each sum over the years both columns have a ring is a matrix
+  product of the NaN zeroed data and the masks.
+  """
+
+  wx = (~np.isnan(x)).astype(np.float64)
+  wy = (~np.isnan(y)).astype(np.float64)
+  x  = np.where(wx > 0, x, 0.0)
+  y  = np.where(wy > 0, y, 0.0)
+
+  count = wx.T.dot(wy)
+  sx    = x.T.dot(wy)
+  sy    = wx.T.dot(y)
+  sxx   = (x*x).T.dot(wy)
+  syy   = wx.T.dot(y*y)
+  sxy   = x.T.dot(y)
+
+  with np.errstate(invalid='ignore', divide='ignore'):
+    vx = count*sxx - sx*sx
+    vy = count*syy - sy*sy
+    r  = (count*sxy - sx*sy) / np.sqrt(vx*vy)
+    r  = np.where((vx > 0) & (vy > 0), np.clip(r, -1, 1), np.nan)
+
+  return np.rint(count).astype(np.int64), r
+
+
+def correlations(samples, min_overlap=50, workers=None, tile=256):
+  """Correlate every pair of samples over the years they overlap.
+
+  *samples* is a list of samples or a RingWidthMatrix (eg, of a
+  normalized stack).  The year matrix is split into tiles of *tile*
+  samples, and the pairs of tiles are computed in a pool of *workers*
+  processes (in-process if workers=1 or there is only one tile).
+
+  Returns a Correlations tuple holding the sample names and the
+  overlap counts and Pearson correlations of all pairs in condensed
+  form (pair (i, j), i < j, is at pair_index(i, j, n); see also
+  squareform).  Correlations of pairs that overlap by fewer than
+  *min_overlap* years are NaN.
+  """
+
+  matrix = samples if isinstance(samples, RingWidthMatrix) else RingWidthMatrix(samples)
+  names, data = matrix.names, matrix.data
+  n = len(names)
+
+  # centering the columns keeps the sums of squares well conditioned
+  with np.errstate(invalid='ignore'):
+    data = data - np.nanmean(data, axis=0) if data.shape[0] else data
+
+  overlap = np.zeros(n*(n-1)//2, dtype=np.int64)
+  r = np.full(n*(n-1)//2, np.nan)
+
+  blocks = [ (a, min(a + tile, n)) for a in range(0, n, tile) ]
+  pairs  = [ (bi, bj) for i, bi in enumerate(blocks) for bj in blocks[i:] ]
+
+  def store(bi, bj, result):
+    count, corr = result
+    i, j = np.meshgrid(np.arange(*bi), np.arange(*bj), indexing='ij')
+    upper = i < j
+    k = pair_index(i[upper], j[upper], n)
+    overlap[k] = count[upper]
+    r[k] = np.where(count[upper] >= max(min_overlap, 3), corr[upper], np.nan)
+
+  if workers == 1 or len(pairs) <= 1:
+    for bi, bj in pairs:
+      store(bi, bj, _pair_block(data[:, bi[0]:bi[1]], data[:, bj[0]:bj[1]]))
+  else:
+    # concurrent.futures needs the futures backport on Python 2
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      futures = [ (bi, bj, pool.submit(_pair_block, data[:, bi[0]:bi[1]], data[:, bj[0]:bj[1]]))
+                  for bi, bj in pairs ]
+      for bi, bj, future in futures:
+        store(bi, bj, future.result())
+
+  return Correlations(names, overlap, r)
@@ -2,10 +2,18 @@
 import pandas as pd
 import numpy as np
 
-from pydendro.rwl import Sample
+from pydendro.sample import Sample
 
-def read(filename):
-  """Read CSV file, with headers core, year, and measurement; and return list of samples."""
+def read(filename, cache=False):
+  """Read CSV file, with headers core, year, and measurement; and return list of samples.
+
+  If *cache* is set, the samples are loaded from (or saved to) the
+  on-disk cache of parsed files (see pydendro.cache).
+  """
+
+  if cache:
+    from pydendro.cache import cached
+    return cached(read, filename, 'csv')
 
   samples = []
   df = pd.read_csv(filename)
@@ -16,6 +24,6 @@ def read(filename):
     if not all(deltas == 1):
       print("WARNING: invalid years in sample:", name)
       continue
-    samples.append(Sample(name, fyog, list(srtd['width'])))
+    samples.append(Sample(name, fyog, srtd['width'].values))
 
   return samples
@@ -0,0 +1,140 @@
+"""PyDendro interval index of sample years."""
+# Copyright (c) 2011, Matthew Emmett.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials provided
+#      with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from bisect import bisect_left, insort
+
+
+class IntervalIndex(object):
+  """Index of named [first, last] year intervals.
+
+  Intervals are grouped by length class: class k holds the intervals
+  whose length (last - first) has k bits, so every interval in it is
+  between 2**(k-1) and 2**k - 1 years long.  Within a class the
+  intervals are kept sorted by their first and last years, and an
+  overlap or stabbing query only has to look at those starting within
+  2**k - 1 years of the query, found by bisection.  A few long
+  intervals (eg, a master chronology) thus do not widen the search
+  among the many short ones.
+
+  For example:
+
+    index = IntervalIndex()
+    index.add('AAAD01', 1790, 1860)
+    index.overlapping(1810, 1850)
+    index.covering(1810)
+
+  """
+
+  def __init__(self):
+    self._intervals = {}
+    self._firsts = {}                   # length class -> sorted (first, name, last)
+    self._lasts = {}                    # length class -> sorted (last, name)
+
+
+  def __len__(self):
+    return len(self._intervals)
+
+  def __contains__(self, name):
+    return name in self._intervals
+
+  def __getitem__(self, name):
+    return self._intervals[name]
+
+
+  def add(self, name, first, last):
+    """Add (or update) interval *name*."""
+
+    if name in self._intervals:
+      self.remove(name)
+
+    self._intervals[name] = (first, last)
+    k = (last - first).bit_length()
+    insort(self._firsts.setdefault(k, []), (first, name, last))
+    insort(self._lasts.setdefault(k, []), (last, name))
+
+  update = add
+
+
+  def remove(self, name):
+    """Remove interval *name*."""
+
+    first, last = self._intervals.pop(name)
+    k = (last - first).bit_length()
+    firsts, lasts = self._firsts[k], self._lasts[k]
+    del firsts[bisect_left(firsts, (first, name, last))]
+    del lasts[bisect_left(lasts, (last, name))]
+
+    if not firsts:
+      del self._firsts[k]
+      del self._lasts[k]
+
+
+  def _matching(self, start, end):
+    """Names of intervals that start by *start* and end by *end* or later."""
+
+    names = []
+    for k, firsts in self._firsts.items():
+      i = bisect_left(firsts, (end - (1 << k) + 1,))
+      j = bisect_left(firsts, (start + 1,))
+      names += [ name for start, name, last in firsts[i:j] if last >= end ]
+
+    return names
+
+
+  def overlapping(self, first, last):
+    """Return names of intervals that overlap [first, last]."""
+
+    return self._matching(last, first)
+
+
+  def covering(self, year):
+    """Return names of intervals that contain *year*."""
+
+    return self.overlapping(year, year)
+
+
+  def spanning(self, first, last):
+    """Return names of intervals that contain all of [first, last]."""
+
+    return self._matching(first, last)
+
+
+  def extent(self, names=None):
+    """Return (first, last) years covered by all intervals (or *names*)."""
+
+    if names is None:
+      if not self._intervals:
+        return None
+      return (min(firsts[0][0] for firsts in self._firsts.values()),
+              max(lasts[-1][0] for lasts in self._lasts.values()))
+
+    intervals = [ self._intervals[name] for name in names ]
+    if not intervals:
+      return None
+    return min(x[0] for x in intervals), max(x[1] for x in intervals)
@@ -0,0 +1,120 @@
+"""PyDendro level-of-detail decimation of ring width series."""
+# Copyright (c) 2011, Matthew Emmett.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials provided
+#      with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import numpy as np
+
+
+class MinMaxPyramid(object):
+  """Min/max pyramid of a ring width series for plotting.
+
+  Level k of the pyramid splits the series into buckets of 2**k rings
+  and records the positions of the smallest and largest ring width in
+  each bucket.  To plot the years [first, last] on a canvas that is
+  *pixels* wide, *decimate* picks the coarsest level whose buckets
+  are no wider than a pixel and returns the minimum and maximum of
+  each bucket in order of occurrence.  The result has at most a few
+  points per pixel however many years are visible, while the plotted
+  envelope of the series is unchanged.  At full zoom the rings are
+  returned as is.
+
+  Positions are relative to the first ring, so shifting the series
+  only changes the *fyog* passed to *decimate*.
+
+  For example:
+
+    pyramid = MinMaxPyramid(sample.widths)
+    years, widths = pyramid.decimate(sample.fyog, 1000, 2000, 1500)
+
+  """
+
+  def __init__(self, widths):
+
+    self.widths = widths = np.asarray(widths, dtype=np.float64)
+
+    positions = np.arange(len(widths))
+    self.levels = [ (positions, positions) ]
+
+    while len(positions) > 1:
+      mins, maxs = self.levels[-1]
+      if len(mins) % 2:
+        mins = np.append(mins, mins[-1])
+        maxs = np.append(maxs, maxs[-1])
+
+      a, b = mins[0::2], mins[1::2]
+      mins = np.where(widths[b] < widths[a], b, a)
+      a, b = maxs[0::2], maxs[1::2]
+      maxs = np.where(widths[b] > widths[a], b, a)
+
+      self.levels.append((mins, maxs))
+      positions = mins
+
+
+  def __len__(self):
+    return len(self.widths)
+
+
+  @property
+  def extent(self):
+    """Smallest and largest ring width, or None for an empty series."""
+
+    if not len(self.widths):
+      return None
+
+    mins, maxs = self.levels[-1]
+    return self.widths[mins[0]], self.widths[maxs[0]]
+
+
+  def decimate(self, fyog, first, last, pixels):
+    """Return (years, widths) to plot years [first, last] over *pixels* pixels.
+
+    One bucket either side of [first, last] is included so that lines
+    run off the edges of the plot.
+    """
+
+    per_pixel = (last - first) / float(max(pixels, 1))
+    level = 0
+    if per_pixel >= 2:
+      level = min(int(np.log2(per_pixel)), len(self.levels) - 1)
+
+    size = 2**level
+    mins, maxs = self.levels[level]
+
+    i = max(int(np.floor((first - fyog) / float(size))) - 1, 0)
+    j = min(int(np.ceil((last - fyog) / float(size))) + 1, len(mins))
+    if j <= i:
+      return np.empty(0), np.empty(0)
+
+    if level == 0:
+      positions = mins[i:j]
+    else:
+      positions = np.empty(2*(j-i), dtype=mins.dtype)
+      positions[0::2] = np.minimum(mins[i:j], maxs[i:j])
+      positions[1::2] = np.maximum(mins[i:j], maxs[i:j])
+
+    return fyog + positions, self.widths[positions]
@@ -0,0 +1,242 @@
+"""PyDendro year aligned ring width matrix."""
+# Copyright (c) 2011, Matthew Emmett.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials provided
+#      with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import numpy as np
+
+
+class RingWidthMatrix(object):
+  """Ring widths of several samples laid out on a common year axis.
+
+  The ring widths are held in *data*, a (years x samples) float array
+  padded with NaN where a sample has no ring.  Row 0 corresponds to
+  *first_year*, and column j holds the sample *names[j]*, whose first
+  ring is in row *offsets[j]*.
+
+  For example, to compute a mean chronology of a list of samples:
+
+    matrix = RingWidthMatrix(samples)
+    chronology = matrix.mean()
+
+  """
+
+  def __init__(self, samples, margin=0):
+
+    samples = list(samples)
+
+    self.names   = [ sample.name for sample in samples ]
+    self.columns = { name: j for j, name in enumerate(self.names) }
+    self.lengths = np.array([ sample.nyears for sample in samples ], dtype=np.int64)
+
+    fyogs = np.array([ sample.fyog for sample in samples ], dtype=np.int64)
+    if len(samples):
+      first = int(fyogs.min())
+      last  = int((fyogs + self.lengths).max()) - 1
+    else:
+      first, last = 0, -1
+
+    self.first_year = first - margin
+    self.offsets    = fyogs - self.first_year
+
+    self.data = np.full((last - first + 1 + 2*margin, len(samples)), np.nan)
+    for j, sample in enumerate(samples):
+      self.data[self.offsets[j]:self.offsets[j]+self.lengths[j], j] = sample.widths
+
+
+  @classmethod
+  def from_stack(cls, stack, samples, margin=0):
+    """Build matrix of the samples in *stack*.
+
+    Stacks hold sample names; *samples* maps names to sample objects
+    (eg, a dictionary or PyDendroModel.get_sample).
+    """
+
+    get = samples if callable(samples) else samples.__getitem__
+    return cls([ get(name) for name in sorted(stack.samples) ], margin=margin)
+
+
+  def __len__(self):
+    return len(self.names)
+
+
+  @property
+  def years(self):
+    """Year axis (one year per row)."""
+
+    return np.arange(self.first_year, self.first_year + self.data.shape[0])
+
+  @property
+  def fyogs(self):
+    """First year of growth of each column."""
+
+    return self.first_year + self.offsets
+
+  @property
+  def lyogs(self):
+    """Last year of growth of each column."""
+
+    return self.first_year + self.offsets + self.lengths - 1
+
+
+  def column(self, name):
+    """Return view of the ring widths of sample *name*."""
+
+    j   = self.columns[name]
+    off = self.offsets[j]
+    return self.data[off:off+self.lengths[j], j]
+
+
+  def window(self, first, last):
+    """Return view of the rows for years *first* through *last*."""
+
+    lo = max(first - self.first_year, 0)
+    hi = max(last - self.first_year + 1, 0)
+    return self.data[lo:hi]
+
+
+  def shift(self, name, years):
+    """Shift sample *name* by *years*.
+
+    Only the column of the sample is moved; the year axis is extended
+    (with some slack) if the sample moves past either end.
+    """
+
+    j   = self.columns[name]
+    off = self.offsets[j]
+    n   = self.lengths[j]
+    new = off + years
+
+    nrows = self.data.shape[0]
+    if new < 0 or new + n > nrows:
+      slack  = max(10, nrows // 10)
+      top    = slack - new if new < 0 else 0
+      bottom = new + n - nrows + slack if new + n > nrows else 0
+      self.data = np.pad(self.data, ((top, bottom), (0, 0)),
+                         mode='constant', constant_values=np.nan)
+      self.first_year -= top
+      self.offsets    += top
+      off += top
+      new += top
+
+    widths = self.data[off:off+n, j].copy()
+    self.data[off:off+n, j] = np.nan
+    self.data[new:new+n, j] = widths
+    self.offsets[j] = new
+
+
+  ##
+  ## statistics
+  ##
+
+  def count(self):
+    """Number of samples with a ring in each year."""
+
+    return np.count_nonzero(~np.isnan(self.data), axis=1)
+
+
+  def mean(self):
+    """Mean ring width of each year (NaN where no sample has a ring)."""
+
+    count = self.count()
+    total = np.nansum(self.data, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+      return np.where(count > 0, total / count, np.nan)
+
+
+  def std(self):
+    """Standard deviation of the ring widths of each year."""
+
+    count = self.count()
+    mean  = self.mean()
+    total = np.nansum((self.data - mean[:,None])**2, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+      return np.where(count > 0, np.sqrt(total / count), np.nan)
+
+
+  def normalized(self, normalization):
+    """Apply *normalization* to all columns at once.
+
+    Normalizations (see pydendro.normalize) act along the first axis
+    and may return fewer rows than they are given, in which case the
+    result is aligned with the last years.  Returns an array shaped
+    like *data*.
+    """
+
+    result = np.asarray(normalization(self.data))
+    if result.shape[0] == self.data.shape[0]:
+      return result
+
+    padded = np.full(self.data.shape, np.nan)
+    padded[self.data.shape[0]-result.shape[0]:] = result
+    return padded
+
+
+##
+## NaN padded (rows x series) arrays
+##
+
+def left_align(data):
+  """Move the series in the columns of NaN padded *data* to row 0.
+
+  Each column is taken to span its first through last non-NaN value;
+  NaNs inside that span are kept.  Returns (aligned, inside, first,
+  lengths): the aligned (n x k) array (NaN past the end of each
+  series), a mask of the rows inside each series, and the first row
+  and length of each series in *data*.
+  """
+
+  nrows, k = data.shape
+  if nrows == 0:
+    data = np.full((1, k), np.nan)
+    nrows = 1
+
+  valid   = ~np.isnan(data)
+  present = valid.any(axis=0)
+  first   = np.where(present, valid.argmax(axis=0), 0)
+  last    = np.where(present, nrows - 1 - valid[::-1].argmax(axis=0), -1)
+  lengths = last - first + 1
+
+  n = int(lengths.max()) if k else 0
+  i = np.arange(n)[:,None]
+  inside = i < lengths[None,:]
+  aligned = np.take_along_axis(data, np.minimum(first[None,:] + i, nrows - 1), axis=0)
+  aligned = np.where(inside, aligned, np.nan)
+
+  return aligned, inside, first, lengths
+
+
+def unalign(aligned, inside, first, shape):
+  """Inverse of left_align: put the series of *aligned* back in place.
+
+  Returns an array of *shape* that is NaN outside the series.
+  """
+
+  data = np.full(shape, np.nan)
+  ii, jj = np.nonzero(inside)
+  data[first[jj] + ii, jj] = aligned[ii, jj]
+  return data
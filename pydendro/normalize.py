@@ -1,4 +1,10 @@
-"""Ring width normalization routines."""
+"""Ring width normalization routines.
+
+Each routine normalizes along the first axis, so several series can be
+normalized at once by passing a NaN padded (years x series) array (see
+pydendro.matrix and normalize_many).  Routines are registered in
+*methods* with the register decorator.
+"""
 # Copyright (c) 2011, Matthew Emmett.  All rights reserved.
 #
 # Redistribution and use in source and binary forms, with or without
@@ -27,8 +33,218 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+from collections import OrderedDict
+
 import numpy as np
 
+from pydendro.matrix import left_align, unalign
+from pydendro.sample import Sample
+from pydendro.spline import spline_curves
+
+
+# registered normalization methods, by name
+methods = OrderedDict()
+
+def register(method):
+  """Register normalization *method* (usable as a decorator)."""
+
+  methods[method.__name__] = method
+  return method
+
+
+def normalize_many(series, method):
+  """Normalize several ring width series with *method* at once.
+
+  The series are right aligned in a NaN padded (rings x series) array
+  so that *method* runs once over all of them.  Methods that return
+  fewer rings than they are given drop them from the start of each
+  series, as they do for a single series.  NaNs inside a series are
+  handled as by *method* (eg, average ignores them).
+
+  Returns a list of arrays (views into one buffer), one per series.
+  """
+
+  series  = [ np.asarray(x, dtype=np.float64) for x in series ]
+  lengths = np.array([ len(x) for x in series ], dtype=np.int64)
+  if not len(series):
+    return []
+
+  nrows = int(lengths.max())
+  tops  = nrows - lengths
+
+  # scatter the concatenated series into the padded array
+  flat = np.concatenate(series)
+  cols = np.repeat(np.arange(len(series)), lengths)
+  rows = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths) + tops[cols]
+
+  data = np.full((nrows, len(series)), np.nan)
+  data[rows, cols] = flat
+
+  result = np.asarray(method(data), dtype=np.float64).reshape((-1, len(series)))
+  dropped = nrows - result.shape[0]
+
+  # gather back, series by series (column major)
+  mask = np.arange(result.shape[0])[None,:] >= tops[:,None]
+  values = result.T[mask]
+  counts = np.maximum(lengths - dropped, 0)
+  return np.split(values, np.cumsum(counts)[:-1])
+
+
+def normalized_samples(samples, method):
+  """Return new samples holding the *samples* normalized by *method*.
+
+  Normalized series are aligned to the last year of each sample, so
+  they can be plotted or written (eg, with pydendro.rwl.write) like
+  any other samples.
+  """
+
+  samples = list(samples)
+  results = normalize_many([ sample.widths for sample in samples ], method)
+  return [ Sample(sample.name, sample.lyog - len(widths) + 1, widths)
+           for sample, widths in zip(samples, results) ]
+
+
+def indices(rws, curves, residuals=False):
+  """Return ring width indices of *rws* given fitted growth *curves*.
+
+  Indices are ratios (rws/curves), or residuals (rws - curves) if
+  *residuals* is set.
+  """
+
+  rws = np.asarray(rws, dtype=np.float64)
+  if residuals:
+    return rws - curves
+  with np.errstate(invalid='ignore', divide='ignore'):
+    return rws / curves
+
+
+##
+## growth curves
+##
+
+def _masked_sums(w, *columns):
+  return [ np.sum(np.where(w, c, 0.0), axis=0) for c in columns ]
+
+
+def linear_curves(rws, positive_slope=False):
+  """Fit straight lines to the columns of NaN padded *rws*.
+
+  Unless *positive_slope* is set, lines with a positive slope are
+  replaced by the mean of the series.  Returns an array shaped like
+  *rws* (NaN where *rws* is NaN).
+  """
+
+  rws = np.asarray(rws, dtype=np.float64)
+  if rws.ndim == 1:
+    return linear_curves(rws[:,None], positive_slope)[:,0]
+
+  y, inside, first, lengths = left_align(rws)
+  curves = _linear(y, inside & ~np.isnan(y), positive_slope)
+
+  curves = unalign(curves, inside, first, rws.shape)
+  curves[np.isnan(rws)] = np.nan
+  return curves
+
+
+def _linear(y, w, positive_slope=False):
+
+  t = np.arange(y.shape[0], dtype=np.float64)[:,None]
+  n, st, stt, sy, sty = _masked_sums(w, w, t, t*t, y, t*y)
+
+  with np.errstate(invalid='ignore', divide='ignore'):
+    det   = n*stt - st*st
+    slope = np.where(det > 0, (n*sty - st*sy) / det, 0.0)
+    if not positive_slope:
+      slope = np.minimum(slope, 0.0)
+    intercept = (sy - slope*st) / n
+
+  return intercept + slope*t
+
+
+def negative_exponential_curves(rws, positive_slope=False, iterations=40):
+  """Fit modified negative exponential curves to the columns of *rws*.
+
+  Each series is fitted with
+
+    curve(t) = a exp(-b t) + k,  a > 0, b > 0, k >= 0,
+
+  where t counts rings from the start of the series.  For a given b
+  the curve is linear in a and k, which are found by least squares,
+  so only b is searched for: by golden section search on log b for
+  all series at once, for a fixed number of *iterations*, starting
+  from a bracket around a closed form estimate of b (from the means
+  of the thirds of the series).  Series for which the constraints
+  don't hold fall back to straight lines (see linear_curves).  NaN
+  padding and gaps are ignored.  Returns an array shaped like *rws*.
+  """
+
+  rws = np.asarray(rws, dtype=np.float64)
+  if rws.ndim == 1:
+    return negative_exponential_curves(rws[:,None], positive_slope, iterations)[:,0]
+
+  y, inside, first, lengths = left_align(rws)
+  w = inside & ~np.isnan(y)
+  y = np.where(w, y, 0.0)
+  wf = w.astype(np.float64)
+  t = np.arange(y.shape[0], dtype=np.float64)[:,None]
+
+  count, sy, syy = wf.sum(axis=0), y.sum(axis=0), (y*y).sum(axis=0)
+
+  def fit(b):
+    # y is zero outside the series, so only sums over the series are
+    # needed (including for the sum of squared residuals)
+    e = np.exp(-b[None,:] * t) * wf
+    se, see, sey = e.sum(axis=0), (e*e).sum(axis=0), (e*y).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+      a = (count*sey - se*sy) / (count*see - se*se)
+      k = (sy - a*se) / count
+      sse = syy - 2*a*sey - 2*k*sy + a*a*see + 2*a*k*se + k*k*count
+    return a, k, np.where(np.isfinite(sse), sse, np.inf)
+
+  # closed form estimate of b from the means of the thirds of each
+  # series: (m2 - m3)/(m1 - m2) = exp(-b*third)
+  third = np.maximum(lengths // 3, 1)
+  segment = np.minimum(t // third[None,:], 2)
+  m1, m2, m3 = [ _masked_sums(w & (segment == s), y)[0]
+                 / np.maximum(_masked_sums(w & (segment == s), w)[0], 1) for s in range(3) ]
+  with np.errstate(invalid='ignore', divide='ignore'):
+    ratio = (m2 - m3) / (m1 - m2)
+    guess = np.where((ratio > 0) & (ratio < 1), -np.log(ratio) / third, 0.05)
+  guess = np.clip(guess, 1e-4, 1.0)
+
+  # golden section search on log b
+  lo = np.log(guess) - np.log(10.0)
+  hi = np.log(guess) + np.log(10.0)
+  g  = (np.sqrt(5.0) - 1) / 2
+  x1 = hi - g*(hi - lo)
+  x2 = lo + g*(hi - lo)
+  f1 = fit(np.exp(x1))[2]
+  f2 = fit(np.exp(x2))[2]
+
+  for _ in range(iterations):
+    left = f1 < f2
+    hi = np.where(left, x2, hi)
+    lo = np.where(left, lo, x1)
+    x  = np.where(left, hi - g*(hi - lo), lo + g*(hi - lo))
+    fx = fit(np.exp(x))[2]
+    x1, x2 = np.where(left, x, x2), np.where(left, x1, x)
+    f1, f2 = np.where(left, fx, f2), np.where(left, f1, fx)
+
+  b = np.exp((lo + hi) / 2)
+  a, k, sse = fit(b)
+
+  curves = a*np.exp(-b[None,:] * t) + k
+  good = (a > 0) & (k >= 0) & np.isfinite(sse) & (count >= 3)
+
+  if not good.all():
+    curves = np.where(good[None,:], curves, _linear(y, w, positive_slope))
+
+  curves = unalign(curves, inside, first, rws.shape)
+  curves[np.isnan(rws)] = np.nan
+  return curves
+
+
+@register
 def proportion_of_last_two_years(rws):
   """\
   Normalize ring widths using the proportion of the last two years
@@ -40,16 +256,65 @@ def proportion_of_last_two_years(rws):
 
   """
 
-  rws = np.array(rws)
+  rws = np.asarray(rws, dtype=np.float64)
 
   return rws[1:]/(rws[1:] + rws[:-1])
 
 
+@register
 def average(rws):
   """\
   Normalize ring widths by their average.
   """
 
-  rws = np.array(rws)
+  rws = np.asarray(rws, dtype=np.float64)
+
+  return rws/np.nanmean(rws, axis=0)
+
+
+@register
+def spline(rws):
+  """\
+  Detrend ring widths with a cubic smoothing spline.
+
+  The spline has a 50% frequency response at 67% of the length of
+  each series (Cook and Peters, 1981).  For example:
+
+    rw[2010] = rw[2010]/spline[2010]
+
+  """
+
+  rws = np.asarray(rws, dtype=np.float64)
+
+  return rws/spline_curves(rws)
+
+
+@register
+def negative_exponential(rws):
+  """\
+  Detrend ring widths with a modified negative exponential growth
+  curve (or a straight line with a negative slope if the curve can't
+  be fitted).  For example:
+
+    rw[2010] = rw[2010]/curve[2010]
+
+  """
+
+  rws = np.asarray(rws, dtype=np.float64)
+
+  return indices(rws, negative_exponential_curves(rws))
+
+
+@register
+def linear(rws):
+  """\
+  Detrend ring widths with a straight line with a negative slope (or
+  the mean, if the slope is positive).  For example:
+
+    rw[2010] = rw[2010]/line[2010]
+
+  """
+
+  rws = np.asarray(rws, dtype=np.float64)
 
-  return rws/np.mean(rws)
+  return indices(rws, linear_curves(rws))
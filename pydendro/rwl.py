@@ -29,75 +29,77 @@
 
 import os
 
+import numpy as np
+
 from collections import namedtuple
 from shutil import move
 from tempfile import mkstemp
 
-class Sample(object):
-  """PyDendro (simple) Sample class."""
-
-  def __str__(self):
-    return str(self.name)
+from pydendro.sample import Sample
 
-  def __repr__(self):
-    return 'Sample(' + self.__str__() + ')'
 
+def read_text(filename):
+  """Read text of file."""
+  lines = []
+  with open(filename, 'r') as f:
+    for line in f:
+      lines.append(line.strip())
+  return lines
 
-  def __init__(self, name, fyog, widths):
-    self.name = name
-    self.fyog = fyog
-    self.widths = widths
 
-  def __iter__(self):
-    return (self.name, self.fyog, self.widths).__iter__()
+def _split(line):
+  """Split a stripped RWL line into name, year and ring width tokens."""
 
+  if line[7] != ' ':
+    line = line[:8] + ' ' + line[8:]
 
-  @property
-  def years(self):
-    return range(self.fyog, self.fyog+self.nyears)
+  return line.split()
 
-  @property
-  def nyears(self):
-    return len(self.widths)
 
-  @property
-  def lyog(self):
-    return self.fyog + len(self.widths) - 1
+def _scale(widths, digits):
+  """Drop end marker from raw integer widths and renormalize."""
 
+  if digits:
+    d = digits
+  else:
+    d = len(str(abs(widths[-1])))
+  factor = 10.0**(d-1)
 
-def read_text(filename):
-  """Read text of file."""
-  lines = []
-  with open(filename, 'r') as f:
-    for line in f:
-      lines.append(line.strip())
-  return lines
+  return [ float(x)/factor for x in widths[:-1] ]
 
 
-def read(filename, digits=None, **kwargs):
-  """Read RWL file and return list of samples."""
+def _iter_records(lines, filename):
+  """Group stripped RWL lines into (name, year, raw widths, first line,
+  last line) records.
 
-  samples      = []
-  year         = None
-  widths       = []
+  A record ends at a negative end marker, at a line that does not
+  start with the record name, or at the end of the input.  Line
+  numbers are zero based.
+  """
 
-  lines = read_text(filename)
-  last_lineno = len(lines) - 1
+  name   = None
+  year   = None
+  widths = []
+  first  = None
+  last   = None
 
   for lineno, line in enumerate(lines):
+    if year is not None and not line.startswith(name):
+      yield name, year, widths, first, last
+      year   = None
+      widths = []
+
     if len(line) == 0:
       continue
 
-    if line[7] != ' ':
-      line = line[:8] + ' ' + line[8:]
-
-    row = line.split()
+    row = _split(line)
 
     try:
       if year is None:
         # only grab name and year first time around
         name    = str(row[0])
         year    = int(row[1])
+        first   = lineno
     except:
       raise ValueError("Unable to parse file '%s' near line %d." % (filename, lineno+1))
 
@@ -107,31 +109,364 @@ def read(filename, digits=None, **kwargs):
     except:
       raise ValueError("Unable to parse file '%s' near line %d." % (filename, lineno+1))
 
-    # are we at the last sample?
-    last = widths[-1] < 0 or lineno == last_lineno
-    if lineno < last_lineno:
-      last = last or not lines[lineno+1].startswith(name)
+    last = lineno
 
-    if last:
+    if widths[-1] < 0:
+      yield name, year, widths, first, last
+      year   = None
+      widths = []
 
-      # renormalize
-      if digits:
-        d = digits
-      else:
-        d = len(str(abs(widths[-1])))
-      factor = 10.0**(d-1)
-      widths = map(lambda x: float(x)/factor, widths[:-1])
+  if year is not None:
+    yield name, year, widths, first, last
 
-      # append to list
-      samples.append(Sample(name, year, widths))
 
-      # reset
-      year   = None
-      widths = []
+def iter_samples(filename_or_fileobj, digits=None):
+  """Read RWL file (or open file object) and yield samples one at a time."""
+
+  if hasattr(filename_or_fileobj, 'read'):
+    f = filename_or_fileobj
+    filename = getattr(f, 'name', '<stream>')
+    lines = (line.strip() for line in f)
+    for name, year, widths, _, _ in _iter_records(lines, filename):
+      yield Sample(name, year, _scale(widths, digits))
+    return
+
+  with open(filename_or_fileobj, 'r') as f:
+    for sample in iter_samples(f, digits=digits):
+      yield sample
+
+
+class _NotFixed(Exception):
+  """Raised when the fast reader has to defer to the tolerant reader."""
+  pass
+
+
+def _field_tables():
+  """Lookup tables for decoding right-aligned integer fields.
+
+  The characters of a six character field are read in pairs (as
+  little-endian uint16).  Summing ``pairs[j][p]`` over the three pairs
+  of a field gives the magnitude of its digits in the low 20 bits and
+  the classes of its characters (space, digit, minus or other, two
+  bits each) in the high 12 bits.  ``kinds[key >> 20]`` is 0 for a
+  blank field, 1 for a number and 16 for anything else.
+  """
+
+  byte  = np.arange(256)
+  kind  = np.full(256, 3, dtype=np.uint32)
+  kind[32], kind[45], kind[48:58] = 0, 2, 1
+  digit = np.where(kind == 1, byte - 48, 0)
+
+  pair  = np.arange(65536)
+  lo, hi = pair & 255, pair >> 8
+  value = 10*digit[lo] + digit[hi]
+  code  = kind[lo] | kind[hi] << 2
+  pairs = [ (value * 100**(2-j) + (code << (20 + 4*j))).astype(np.uint32)
+            for j in range(3) ]
+
+  # a single run of digits, flush right, with an optional leading
+  # minus; the first character must be blank so that fields do not run
+  # into each other
+  kinds = np.full(4096, 16, dtype=np.int8)
+  kinds[0] = 0
+  for nspace in range(1, 6):
+    for minus in (0, 1):
+      classes = [ 0 ]*nspace + [ 2 ]*minus + [ 1 ]*(6 - nspace - minus)
+      if classes[-1] == 1:
+        kinds[sum(c << 2*i for i, c in enumerate(classes))] = 1
+
+  return pairs, kinds
+
+_PAIRS, _KINDS = _field_tables()
+
+# the minus bits of a field key
+_MINUS = np.uint32(sum(2 << (20 + 2*i) for i in range(6)))
+
+def _bytes(byte):
+  """Return *byte* repeated in all eight bytes of a uint64."""
+
+  return np.uint64(byte * 0x0101010101010101)
+
+# name lengths by the bit pattern of blanks in the name columns (bit i
+# for column i): the blanks must follow a non blank first character
+_NAMELEN = np.zeros(256, dtype=np.int64)
+_NAMELEN[(255 << np.arange(1, 9)) & 255] = np.arange(1, 9)
+
+# masks of the first n characters of a name read as a little-endian uint64
+_PREFIX = np.array([ (1 << 8*n) - 1 for n in range(9) ], dtype=np.uint64)
+
+
+def _decode_lines(chars, lengths, signed):
+  """Decode the fixed-width fields of a block of lines.
+
+  Row i of *chars* holds the characters starting at line i; those
+  past the *lengths* of the lines are blanked out here.  Minus signs
+  are only looked at if *signed* is set.
+
+  Returns the names (as little-endian uint64), name lengths, years,
+  ring width counts and fixed flags of the lines, and the concatenated
+  ring widths of the fixed lines.
+  """
+
+  nlines, ncols = chars.shape
+  nfields = (ncols - 12) // 6
+
+  short = np.flatnonzero(lengths < ncols)
+  rows  = chars[short]
+  rows[np.arange(ncols) >= lengths[short,None]] = 32
+  chars[short] = rows
+
+  # names: printable, flush left, at most 8 characters; the name columns
+  # of each line are read as one uint64 and classified a byte at a time
+  names     = np.ndarray(nlines, dtype='<u8', buffer=chars, strides=(ncols,)).copy()
+  low       = names & _bytes(0x7f)
+  spaces    = names ^ _bytes(0x20)
+  blanks    = ~((spaces & _bytes(0x7f)) + _bytes(0x7f) | spaces) & _bytes(0x80)
+  printable = (low + _bytes(0x5f)) & ~(low + _bytes(0x01)) & ~names & _bytes(0x80)
+  blankbits = ((blanks >> np.uint64(7)) * np.uint64(0x0102040810204080)) >> np.uint64(56)
+  namelen   = _NAMELEN[blankbits.astype(np.uint8)]
+  fixed     = ((blanks | printable) == _bytes(0x80)) & (namelen > 0)
+
+  # years and ring widths, decoded a pair of characters at a time
+  pairs  = chars.view('<u2')
+  key    = _PAIRS[1][pairs[:,4]] + _PAIRS[2][pairs[:,5]]
+  years  = (key & 0xfffff).astype(np.int64)
+  if signed:
+    years[(key & _MINUS) != 0] *= -1
+  fixed &= _KINDS[key >> 20] == 1
+
+  fields = pairs[:,6:].reshape(nlines, nfields, 3)
+  key    = np.take(_PAIRS[0], fields[...,0], mode='wrap')
+  key   += np.take(_PAIRS[1], fields[...,1], mode='wrap')
+  key   += np.take(_PAIRS[2], fields[...,2], mode='wrap')
+  kind   = np.take(_KINDS, key >> 20, mode='wrap')
+  counts = np.zeros(nlines, dtype=np.int64)
+  for column in kind.T:
+    counts += column
+  fixed &= (counts > 0) & (counts < 16)
+  counts[~fixed] = 0
+
+  present = kind == 1
+  present[~fixed] = False
+  key  = key[present]
+  flat = (key & 0xfffff).view(np.int32)
+  if signed:
+    flat[(key & _MINUS) != 0] *= -1
+
+  return names, namelen, years, counts, fixed, flat
+
+
+def _read_fixed(data, digits):
+  """Read RWL samples from raw bytes using fixed-width column slicing.
+
+  Lines that do not fit the fixed layout (8 character name, 4
+  character year, 6 character widths) are split with the tolerant
+  parser.  Raises _NotFixed if the file can not be read this way with
+  results identical to _iter_records.
+  """
+
+  buf = np.frombuffer(data, dtype=np.uint8)
+  nl  = np.flatnonzero(buf == 10)
+
+  # a carriage return just before a newline is part of the line break;
+  # any other one makes the line loose (see below)
+  crlf = buf[np.maximum(nl - 1, 0)] == 13
+
+  starts = np.concatenate(([0], nl+1))
+  ends   = np.concatenate((nl - crlf, [len(buf)]))
+  if starts[-1] == len(buf):
+    starts, ends = starts[:-1], ends[:-1]
+
+  nlines = len(starts)
+  if nlines == 0:
+    return []
+
+  # lay the lines out in rows of ncols characters: row i of window
+  # holds the characters starting at byte i; the last few lines, which
+  # run off the end of the buffer, are copied into blank rows instead
+  lengths = ends - starts
+  nfields = max(0, -(-(int(lengths.max()) - 12) // 6))
+  ncols   = 12 + 6*nfields
+
+  window = np.lib.stride_tricks.as_strided(
+    buf, shape=(max(len(buf) - ncols + 1, 0), ncols), strides=(1, 1))
+  inner  = np.searchsorted(starts, len(buf) - ncols, side='right')
+  tail   = np.full((nlines - inner, ncols), 32, dtype=np.uint8)
+  for row, start in zip(tail, starts[inner:]):
+    row[:len(buf) - start] = buf[start:]
+
+  # decode a block of lines at a time to keep the temporaries in cache
+  signed = b'-' in data
+  step   = max(1, 2**18 // ncols)
+  blocks = [ _decode_lines(window[starts[i:min(i+step, inner)]],
+                           lengths[i:min(i+step, inner)], signed)
+             for i in range(0, inner, step) ]
+  blocks.append(_decode_lines(tail, lengths[inner:], signed))
+  names, namelen, years, counts, fixed, flat = [
+    np.concatenate(parts) for parts in zip(*blocks) ]
+
+  # split the remaining lines with the tolerant parser
+  blank = np.zeros(nlines, dtype=bool)
+  loose = {}
+  for lineno in np.flatnonzero(~fixed):
+    if b'\r' in data[starts[lineno]:ends[lineno]]:
+      raise _NotFixed
+    try:
+      line = data[starts[lineno]:ends[lineno]].decode('utf-8').strip()
+      if len(line) == 0:
+        blank[lineno] = True
+        continue
+      row = _split(line)
+      loose[lineno] = (line, str(row[0]), int(row[1]), list(map(int, row[2:])))
+    except:
+      raise _NotFixed
+    if not loose[lineno][3]:
+      raise _NotFixed
+
+  def name_of(lineno):
+    if lineno in loose:
+      return loose[lineno][1]
+    return data[starts[lineno]:starts[lineno]+namelen[lineno]].decode('ascii')
+
+  def line_of(lineno):
+    if lineno in loose:
+      return loose[lineno][0]
+    return data[starts[lineno]:ends[lineno]].decode('ascii')
+
+  # concatenated ring widths of all lines
+  if loose:
+    flat   = flat.astype(np.int64)
+    before = np.concatenate(([0], np.cumsum(counts)))
+    where  = []
+    values = []
+    for lineno in sorted(loose):
+      where  += [ before[lineno] ] * len(loose[lineno][3])
+      values += loose[lineno][3]
+      counts[lineno] = len(loose[lineno][3])
+    flat = np.insert(flat, where, values)
+  if len(flat) == 0:
+    return []
+  offsets = np.concatenate(([0], np.cumsum(counts)))
+  last    = np.where(counts > 0, flat[np.maximum(offsets[1:]-1, 0)], 0)
+
+  # record boundaries: negative end marker, blank line, end of file, or
+  # next line not starting with this name
+  follows = np.zeros(nlines, dtype=bool)
+  follows[:-1] = ((names[1:] ^ names[:-1]) & _PREFIX[namelen[:-1]]) == 0
+  for lineno in loose:
+    for i in (lineno-1, lineno):
+      if 0 <= i < nlines-1 and not blank[i] and not blank[i+1]:
+        follows[i] = line_of(i+1).startswith(name_of(i))
+  follows[:-1] &= ~blank[1:]
+
+  end   = ~blank & ((last < 0) | ~follows)
+  begin = ~blank
+  begin[1:] &= blank[:-1] | end[:-1]
+
+  first = np.flatnonzero(begin)
+  final = np.flatnonzero(end)
+
+  # every line of a record must carry the record name, otherwise the
+  # boundaries above are not the ones the tolerant reader finds
+  lines = np.flatnonzero(~blank)
+  head  = first[(np.cumsum(begin) - 1)[lines]]
+  same  = names[lines] == names[head]
+  if loose:
+    odd = np.isin(lines, list(loose)) | np.isin(head, list(loose))
+    for i, h in zip(lines[odd], head[odd]):
+      same[lines == i] = name_of(i) == name_of(h)
+  if not same.all():
+    raise _NotFixed
+
+  # renormalize all ring widths at once
+  lo, hi = offsets[first], offsets[final+1]
+  if digits:
+    d = np.full(len(first), digits)
+  else:
+    d = np.searchsorted(10**np.arange(1, 19), np.abs(flat[hi-1]), side='right') + 1
+  factor = 10.0**(d-1)
+  if (factor == factor[0]).all():
+    scaled = flat / factor[0]
+  else:
+    scaled = flat / np.repeat(factor, hi-lo)
+
+  # build samples
+  samples = []
+  for f, a, b, s, n, year in zip(first.tolist(), lo.tolist(), hi.tolist(),
+                                 starts[first].tolist(), namelen[first].tolist(),
+                                 years[first].tolist()):
+    if f in loose:
+      samples.append(Sample(loose[f][1], loose[f][2], scaled[a:b-1]))
+    else:
+      samples.append(Sample(data[s:s+n].decode('ascii'), year, scaled[a:b-1]))
 
   return samples
 
 
+def read(filename, digits=None, fast=True, cache=False, **kwargs):
+  """Read RWL file and return list of samples.
+
+  If *fast* is set and *filename* is a path, the file is decoded in
+  bulk with NumPy (see _read_fixed), falling back to iter_samples
+  when it does not fit the fixed RWL layout.
+
+  If *cache* is set, the samples are loaded from (or saved to) the
+  on-disk cache of parsed files (see pydendro.cache).
+  """
+
+  if cache and not hasattr(filename, 'read'):
+    from pydendro.cache import cached
+    return cached(lambda x: read(x, digits=digits, fast=fast), filename,
+                  'rwl:%s' % digits)
+
+  if fast and not hasattr(filename, 'read'):
+    with open(filename, 'rb') as f:
+      data = f.read()
+    try:
+      return _read_fixed(data, digits)
+    except _NotFixed:
+      pass
+
+  return list(iter_samples(filename, digits=digits))
+
+
+def _format_sample(name, fyog, widths, digits):
+  """Format one sample as RWL lines (decades, 9999 end marker)."""
+
+  # scale to integers and append marker year
+  scaled = np.asarray(widths, dtype=np.float64) * 10**(digits-1)
+  if not np.isfinite(scaled).all():
+    raise ValueError("Unable to write non-finite ring widths of sample '%s'." % name)
+
+  # round half away from zero, as round() does in Python 2
+  magnitude = np.abs(scaled)
+  rounded = np.floor(magnitude)
+  rounded += magnitude - rounded >= 0.5
+  values = (np.sign(scaled) * rounded).astype(np.int64).tolist() + [ 9999 ]
+
+  # split into decade rows: a row ends after each year ending in 9
+  nvalues = len(values)
+  breaks = list(range(9 - (fyog % 10) + 1, nvalues, 10))
+  bounds = [ 0 ] + breaks + [ nvalues ]
+
+  header = "%-6s  %4d"
+  fmt  = []
+  args = []
+  for lo, hi in zip(bounds[:-1], bounds[1:]):
+    fmt.append(header + "%6d"*(hi-lo) + "\r\n")
+    args.append(name)
+    args.append(fyog + lo)
+    args.extend(values[lo:hi])
+
+  return "".join(fmt) % tuple(args)
+
+
+def format_sample(sample, digits=4):
+  """Return the RWL lines write would write for *sample*."""
+
+  return _format_sample(sample.name, sample.fyog, sample.widths, digits)
+
+
 def write(filename, samples, sort=True, key=None, digits=4):
   """Write samples..."""
 
@@ -141,22 +476,113 @@ def write(filename, samples, sort=True, key=None, digits=4):
     else:
       samples = sorted(samples, key=key)
 
+  text = "".join([ _format_sample(sample.name, sample.fyog, sample.widths, digits)
+                   for sample in samples ])
+
   fd, tmp = mkstemp()
 
   with os.fdopen(fd, 'wb') as f:
-    for sample in samples:
-      name, fyog, rws = sample.name, sample.fyog, sample.widths
+    f.write(text.encode('ascii'))
+
+  move(tmp, filename)
 
-      # append marker year
-      rws = rws + [ 9999.0/10.0**(digits-1) ]
 
-      line = "%-6s  %4d" % (name, fyog)
-      for i, year in enumerate(range(fyog, fyog+len(rws))):
-        line += "%6d" % int(round(rws[i]*10**(digits-1)))
-        if ((year+1) % 10 == 0) and (i < len(rws)-1):
-          f.write((line + "\r\n").encode('ascii'))
-          line = "%-6s  %4d" % (name, year+1)
+def changed_samples(filename, samples, digits=4):
+  """Return the samples that differ from those saved in *filename*.
 
-      f.write((line + "\r\n").encode('ascii'))
+  A sample differs unless the lines saved for it are exactly the lines
+  write would write for it now.  Returns None if the file does not
+  exist or does not hold the same set of samples, in which case it has
+  to be rewritten in full.
+  """
 
-  move(tmp, filename)
+  from pydendro.rwlindex import IndexedRWL
+
+  if not os.path.exists(filename):
+    return None
+
+  try:
+    with IndexedRWL(filename) as saved:
+      if set(saved.names) != set(sample.name for sample in samples):
+        return None
+      return [ sample for sample in samples
+               if saved.raw(sample.name) != format_sample(sample, digits).encode('ascii') ]
+  except (IOError, ValueError):
+    return None
+
+
+def patch(filename, samples, digits=4):
+  """Update the given (changed) samples of an existing RWL file.
+
+  Only the lines of the changed samples are rewritten; everything
+  else is copied through unchanged (or, if every changed sample keeps
+  its size, left untouched and the new lines are written in place).
+  Samples that are not in the file yet are appended.  The sidecar
+  index of the file (see IndexedRWL) is kept up to date.
+  """
+
+  from pydendro.rwlindex import IndexedRWL, dump_index
+
+  changed  = {}
+  appended = []
+
+  with IndexedRWL(filename) as rwl:
+    old  = rwl._index
+    size = rwl._size
+
+    for sample in samples:
+      lines = _format_sample(sample.name, sample.fyog, sample.widths, digits).encode('ascii')
+      entry = (lines, sample.fyog, sample.fyog + len(sample.widths) - 1)
+      if sample.name in old:
+        changed[sample.name] = entry
+      else:
+        appended.append((sample.name, entry))
+
+    # new byte ranges
+    index = {}
+    shift = 0
+    for name in sorted(old, key=lambda x: old[x][0]):
+      start, end, fyog, lyog = old[name]
+      if name in changed:
+        lines, fyog, lyog = changed[name]
+        index[name] = (start + shift, start + shift + len(lines), fyog, lyog)
+        shift += len(lines) - (end - start)
+      else:
+        index[name] = (start + shift, end + shift, fyog, lyog)
+
+    newline = appended and size > 0 and rwl._map[size-1:size] != b'\n'
+    position = size + shift + (2 if newline else 0)
+    for name, (lines, fyog, lyog) in appended:
+      index[name] = (position, position + len(lines), fyog, lyog)
+      position += len(lines)
+
+    replaced = sorted((old[name][0], old[name][1], lines)
+                      for name, (lines, _, _) in changed.items())
+
+    in_place = not appended and shift == 0 and all(
+      end - start == len(lines) for start, end, lines in replaced)
+
+    if not in_place:
+      fd, tmp = mkstemp()
+      with os.fdopen(fd, 'wb') as f:
+        position = 0
+        for start, end, lines in replaced:
+          f.write(rwl._map[position:start])
+          f.write(lines)
+          position = end
+        f.write(rwl._map[position:size])
+        if newline:
+          f.write(b'\r\n')
+        for name, (lines, _, _) in appended:
+          f.write(lines)
+
+  if in_place:
+    with open(filename, 'r+b') as f:
+      for start, end, lines in replaced:
+        f.seek(start)
+        f.write(lines)
+  else:
+    move(tmp, filename)
+
+  stat = os.stat(filename)
+  dump_index(filename + '.idx', stat.st_size, stat.st_mtime, index)
@@ -0,0 +1,196 @@
+"""PyDendro random access RWL reader."""
+# Copyright (c) 2011, Matthew Emmett.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials provided
+#      with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from __future__ import absolute_import
+
+import io
+import json
+import mmap
+import os
+
+from pydendro.rwl import _iter_records, iter_samples
+
+
+class IndexedRWL(object):
+  """Random access reader for RWL files.
+
+  The file is memory mapped and indexed by sample name: for each
+  sample the byte range of its lines and its first and last years are
+  recorded.  The index is kept in a sidecar file (*filename*.idx) and
+  rebuilt whenever the size or modification time of the RWL file
+  changes.
+
+  For example:
+
+    rwl = IndexedRWL('site1.rwl')
+    sample = rwl.get('AAAD01')
+
+  """
+
+  def __init__(self, filename, digits=None, sidecar=True):
+    self.filename = filename
+    self.digits = digits
+    self.sidecar = filename + '.idx' if sidecar else None
+
+    self._file = open(filename, 'rb')
+    self._size = os.fstat(self._file.fileno()).st_size
+    self._mtime = os.fstat(self._file.fileno()).st_mtime
+    if self._size > 0:
+      self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+      self._map = b''
+
+    self._index = self._load_index()
+    if self._index is None:
+      self._index = self._build_index()
+      self._save_index()
+
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def __len__(self):
+    return len(self._index)
+
+  def __contains__(self, name):
+    return name in self._index
+
+
+  def close(self):
+    """Close the underlying file and memory map."""
+
+    if self._size > 0:
+      self._map.close()
+    self._file.close()
+
+
+  @property
+  def names(self):
+    """Return list of sample names, in file order."""
+
+    return sorted(self._index, key=lambda x: self._index[x][0])
+
+
+  def extent(self, name):
+    """Return first and last years of sample *name*."""
+
+    start, end, fyog, lyog = self._index[name]
+    return fyog, lyog
+
+
+  def raw(self, name):
+    """Return the bytes of the lines of sample *name*."""
+
+    start, end, fyog, lyog = self._index[name]
+    return self._map[start:end]
+
+
+  def get(self, name):
+    """Return sample *name*, decoding only its lines."""
+
+    start, end, fyog, lyog = self._index[name]
+    text = self._map[start:end].decode('utf-8')
+    for sample in iter_samples(io.StringIO(text), digits=self.digits):
+      return sample
+
+
+  def years_covering(self, year):
+    """Return list of samples that cover *year*."""
+
+    return [ self.get(name) for name in self.names
+             if self._index[name][2] <= year <= self._index[name][3] ]
+
+
+  def _iter_lines(self):
+    """Yield stripped lines, recording the offset at which each starts."""
+
+    self._offsets = [ 0 ]
+    start = 0
+    while start < self._size:
+      end = self._map.find(b'\n', start)
+      end = self._size if end < 0 else end + 1
+      self._offsets.append(end)
+      yield self._map[start:end].decode('utf-8').strip()
+      start = end
+
+
+  def _build_index(self):
+    """Scan the file and build the sample index."""
+
+    index = {}
+    for name, year, widths, first, last in _iter_records(self._iter_lines(), self.filename):
+      index[name] = (self._offsets[first], self._offsets[last+1],
+                     year, year + len(widths) - 2)
+    del self._offsets
+
+    return index
+
+
+  def _load_index(self):
+    """Load the sample index from the sidecar, if it is up to date."""
+
+    if self.sidecar is None or not os.path.exists(self.sidecar):
+      return None
+
+    try:
+      with open(self.sidecar, 'r') as f:
+        sidecar = json.load(f)
+    except (IOError, OSError, ValueError):
+      return None
+
+    if sidecar.get('size') != self._size or sidecar.get('mtime') != self._mtime:
+      return None
+
+    return { name: tuple(entry) for name, entry in sidecar['samples'].items() }
+
+
+  def _save_index(self):
+    """Save the sample index to the sidecar."""
+
+    if self.sidecar is None:
+      return
+
+    dump_index(self.sidecar, self._size, self._mtime, self._index)
+
+
+def dump_index(sidecar, size, mtime, index):
+  """Write a sample index for an RWL file of the given size and mtime.
+
+  The index maps sample names to (start, end, first year, last year)
+  tuples.  Failures to write the sidecar are ignored.
+  """
+
+  try:
+    with open(sidecar, 'w') as f:
+      json.dump({ 'size': size, 'mtime': mtime, 'samples': index }, f)
+  except (IOError, OSError):
+    pass
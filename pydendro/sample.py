@@ -27,41 +27,87 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+import numpy as np
+
+
 class Sample(object):
   """PyDendro Sample class.
 
-  A sample is a collection of ring widths.
+  A sample is a named series of ring widths that starts at its first
+  year of growth (fyog).  The ring widths are held in a contiguous
+  NumPy float array, which may be a view into a larger buffer shared
+  by all the samples read from one file.
+
+  The *version* of a sample is bumped whenever its ring widths are
+  replaced (or, for in place edits, by calling *touch*), so that
+  results derived from the widths can be cached.
   """
 
+  __slots__ = ('name', 'fyog', 'original_fyog', 'version', '_widths')
+
   def __str__(self):
     return str(self.name)
-    
 
-  def __init__(self):
-    self.name = None
-    self.first_year = None
-    self.ring_widths = []
-    self.oiginal_first_year = None
+  def __repr__(self):
+    return 'Sample(' + self.__str__() + ')'
+
 
+  def __init__(self, name=None, fyog=None, widths=()):
+    self.name = name
+    self.fyog = fyog
+    self.original_fyog = fyog
+    self.version = 0
+    self.widths = widths
 
-  def from_plain(self, sample):
-    self.name = sample.name
-    self.first_year = sample.fyog
-    self.ring_widths += sample.widths
-    self.original_first_year = self.first_year
+  def __iter__(self):
+    return (self.name, self.fyog, self.widths).__iter__()
 
-  def to_plain(self):
-    from rwl import Sample as PlainSample
-    sample = PlainSample
-    sample.name = self.name
-    sample.fyog = self.first_year
-    sample.widths = self.ring_widths
-    return sample
+
+  @property
+  def widths(self):
+    return self._widths
+
+  @widths.setter
+  def widths(self, widths):
+    self._widths = np.asarray(widths, dtype=np.float64)
+    self.version += 1
+
+  def touch(self):
+    """Note that the ring widths were changed in place."""
+
+    self.version += 1
 
   @property
   def years(self):
-    return range(self.first_year, self.first_year+len(self.ring_widths))
+    return range(self.fyog, self.fyog+self.nyears)
 
   @property
   def nyears(self):
-    return len(self.ring_widths)
+    return len(self._widths)
+
+  @property
+  def lyog(self):
+    return self.fyog + len(self._widths) - 1
+
+
+  # names used by the UI
+
+  @property
+  def first_year(self):
+    return self.fyog
+
+  @first_year.setter
+  def first_year(self, first_year):
+    self.fyog = first_year
+
+  @property
+  def original_first_year(self):
+    return self.original_fyog
+
+  @property
+  def ring_widths(self):
+    return self._widths
+
+  @ring_widths.setter
+  def ring_widths(self, ring_widths):
+    self.widths = ring_widths
@@ -0,0 +1,177 @@
+"""Cubic smoothing splines for detrending ring width series."""
+# Copyright (c) 2011, Matthew Emmett.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials provided
+#      with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import numpy as np
+
+from pydendro.matrix import left_align, unalign
+
+
+def stiffness(nyrs, f=0.5):
+  """Smoothing parameter of a spline with frequency response *f* at period *nyrs*.
+
+  The spline passes a fraction *f* of the amplitude of a sinusoid
+  with a period of *nyrs* years (Cook and Peters, 1981).  For unit
+  spacing, the frequency response of the spline with smoothing
+  parameter p is
+
+    H(w) = r(w) / (r(w) + p q(w)),
+    r(w) = (2 + cos w) / 3,  q(w) = 4 (1 - cos w)**2,
+
+  which is solved for p at w = 2 pi / nyrs.
+  """
+
+  c = np.cos(2*np.pi / np.asarray(nyrs, dtype=np.float64))
+  return (1.0 - f) / f * (2.0 + c) / (12.0 * (1.0 - c)**2)
+
+
+def solve_pentadiagonal(d, e, f, b):
+  """Solve symmetric positive definite pentadiagonal systems.
+
+  Column j of the (n x k) arrays is one system: *d* holds the
+  diagonal, *e* the first off diagonal (e[i] = A[i,i+1]), *f* the
+  second off diagonal (f[i] = A[i,i+2]) and *b* the right hand side.
+  The systems are solved at once by an LDL' factorization that steps
+  through the rows, so the cost is linear in n for the whole batch.
+  """
+
+  n = d.shape[0]
+  D  = np.empty_like(d)
+  L1 = np.zeros_like(d)
+  L2 = np.zeros_like(d)
+  z  = np.empty_like(b)
+
+  for i in range(n):
+    D[i] = d[i]
+    z[i] = b[i]
+    if i >= 1:
+      D[i] -= L1[i-1]**2 * D[i-1]
+      z[i] -= L1[i-1] * z[i-1]
+    if i >= 2:
+      D[i] -= L2[i-2]**2 * D[i-2]
+      z[i] -= L2[i-2] * z[i-2]
+    if i < n-1:
+      L1[i] = e[i]
+      if i >= 1:
+        L1[i] -= L2[i-1] * L1[i-1] * D[i-1]
+      L1[i] /= D[i]
+    if i < n-2:
+      L2[i] = f[i] / D[i]
+
+  x = z / D
+  for i in range(n-2, -1, -1):
+    x[i] -= L1[i] * x[i+1]
+    if i < n-2:
+      x[i] -= L2[i] * x[i+2]
+
+  return x
+
+
+def smooth(y, lengths, p):
+  """Fit cubic smoothing splines to the columns of *y*.
+
+  Column j of *y* holds a series of *lengths[j]* values starting in
+  row 0 (rows past the end are ignored) and is smoothed with
+  smoothing parameter *p[j]*.  The spline g minimizes
+
+    sum (y - g)**2 + p * integral g''**2,
+
+  which for unit spacing gives the (n-2 x n-2) pentadiagonal system
+  (R + p Q'Q) c = Q'y and g = y - p Q c (Reinsch, 1967).  Series of
+  fewer than three values are returned as is.
+  """
+
+  y = np.where(np.arange(y.shape[0])[:,None] < lengths[None,:], y, 0.0)
+  n, k = y.shape
+  m = n - 2
+  if m < 1:
+    return y
+
+  p = np.broadcast_to(np.asarray(p, dtype=np.float64), (k,))
+
+  # rows at or past the end of a (shorter) series are decoupled
+  # identity rows with a zero right hand side
+  rows = np.arange(m)[:,None]
+  size = (lengths - 2)[None,:]
+
+  d = np.where(rows < size, 2.0/3 + 6*p, 1.0)
+  e = np.where(rows < size - 1, 1.0/6 - 4*p, 0.0)
+  f = np.where(rows < size - 2, p, 0.0)
+  b = np.where(rows < size, y[:-2] - 2*y[1:-1] + y[2:], 0.0)
+
+  c = solve_pentadiagonal(d, e, f, b)
+
+  qc = np.zeros_like(y)
+  qc[:-2] += c
+  qc[1:-1] -= 2*c
+  qc[2:] += c
+
+  return y - p * qc
+
+
+def spline_curves(rws, nyrs=None, f=0.5, fraction=0.67):
+  """Fit smoothing spline growth curves to the columns of *rws*.
+
+  Each column is a NaN padded series; NaNs inside a series are filled
+  by linear interpolation for the fit.  The stiffness of each spline
+  is a frequency response of *f* at a period of *nyrs* years, or at
+  *fraction* of the length of the series if *nyrs* is None.  Returns
+  an array shaped like *rws* (NaN where *rws* is padded).
+  """
+
+  rws = np.asarray(rws, dtype=np.float64)
+  if rws.ndim == 1:
+    return spline_curves(rws[:,None], nyrs, f, fraction)[:,0]
+
+  y, inside, first, lengths = left_align(rws)
+  if not inside.any():
+    return np.full(rws.shape, np.nan)
+
+  # fill gaps by linear interpolation between their neighbours
+  n = y.shape[0]
+  i = np.arange(n)[:,None]
+  gaps = inside & np.isnan(y)
+  y = np.where(inside, y, 0.0)
+  if gaps.any():
+    before = np.maximum.accumulate(np.where(gaps, -1, i), axis=0)
+    after  = np.minimum.accumulate(np.where(gaps, n, i)[::-1], axis=0)[::-1]
+    before = np.maximum(before, 0)
+    after  = np.minimum(after, n - 1)
+    y0 = np.take_along_axis(y, before, axis=0)
+    y1 = np.take_along_axis(y, after, axis=0)
+    t = (i - before) / np.maximum(after - before, 1).astype(np.float64)
+    y = np.where(gaps, y0 + t * (y1 - y0), y)
+
+  if nyrs is None:
+    nyrs = np.maximum(fraction * lengths, 2.0)
+  p = stiffness(np.broadcast_to(nyrs, (rws.shape[1],)), f)
+
+  curves = unalign(smooth(y, lengths, p), inside, first, rws.shape)
+  curves[np.isnan(rws)] = np.nan
+
+  return curves
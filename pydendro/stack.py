@@ -28,28 +28,59 @@
 
 
 class Stack(object):
+  """PyDendro Stack class.
+
+  A stack is a named set of sample names.  The names are kept in a
+  (private) set, so adding, removing and testing samples costs O(1)
+  per sample.  *samples* is a read-only frozenset snapshot of the
+  names, which is only rebuilt when it is asked for after the stack
+  changed.
+  """
 
   def __init__(self, name='', immutable=True):
 
     self.name = name
     self.immutable = immutable
-    self.samples = set()
     self.frozen = False
 
+    self._samples = set()
+    self._snapshot = frozenset()
+
 
   def __str__(self):
     return str(self.name)
 
+  def __contains__(self, sample):
+    return sample in self._samples
+
+  def __len__(self):
+    return len(self._samples)
+
+
+  @property
+  def samples(self):
+    """Read-only snapshot of the sample names."""
+
+    if self._snapshot is None:
+      self._snapshot = frozenset(self._samples)
+    return self._snapshot
+
 
   def add_sample(self, sample):
-    self.samples.add(sample)
+    self._samples.add(sample)
+    self._snapshot = None
 
 
   def remove_sample(self, sample):
-    self.samples.remove(sample)
+    self._samples.remove(sample)
+    self._snapshot = None
   
 
   def add_samples(self, samples):
-    for sample in samples:
-      self.samples.add(sample)
+    self._samples.update(samples)
+    self._snapshot = None
+
 
+  def remove_samples(self, samples):
+    self._samples.difference_update(samples)
+    self._snapshot = None
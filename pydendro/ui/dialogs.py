@@ -30,6 +30,8 @@ import os
 import os.path
 import pydendro.rwl as rwl
 
+from pydendro.crossdate import crossdate, chronology
+
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
@@ -40,7 +42,7 @@ class PyDendroNormalizationDialog(QDialog):
 
   def __init__(self, parent, ui, model):
 
-    import pydendro.normalize
+    from pydendro.normalize import methods
     from textwrap import dedent
 
     super(QDialog, self).__init__(parent)
@@ -51,10 +53,8 @@ class PyDendroNormalizationDialog(QDialog):
 
     
     norms = [ (None, 'none', 'No normalization.') ]
-    for name in dir(pydendro.normalize):
-      attr = getattr(pydendro.normalize, name, None)
-      if callable(attr):
-        norms.append((attr, attr.__name__, dedent(attr.__doc__)))
+    for name, method in methods.items():
+      norms.append((method, name, dedent(method.__doc__ or '')))
 
     self.norms = norms
 
@@ -110,7 +110,6 @@ class PyDendroNormalizationDialog(QDialog):
 
     if len(items) == 1:
       self.model.normalization = items[0].callable
-      self.ui.on_draw()
 
 
   def on_rejected(self):
@@ -228,11 +227,16 @@ class PyDendroSaveStacksDialog(QDialog):
         samples = []
         for sample_name in stack.samples:
           sample = self.model.get_sample(sample_name)
-          samples.append(sample.to_plain())
+          samples.append(sample)
 
         if samples:
           fullname = os.path.join(dirname, str(filename.text()))
-          rwl.write(fullname, samples)
+          changed = rwl.changed_samples(fullname, samples)
+          if changed is not None:
+            if changed:
+              rwl.patch(fullname, changed)
+          else:
+            rwl.write(fullname, samples)
 
     self.accept()
 
@@ -292,7 +296,6 @@ class PyDendroDeleteStacksDialog(QDialog):
       stack = str(item.text())
       self.model.remove_stack(stack)
       
-    self.ui.update_stacks()
     self.accept()
 
 
@@ -349,7 +352,112 @@ class PyDendroRenameStackDialog(QDialog):
     new_name = str(self.new_name_input.text())
     
     stack = self.model.rename_stack(old_name, new_name)
-    self.ui.update_stacks()
+
+    self.accept()
+
+
+  def on_rejected(self):
+
+    self.reject()
+
+
+###############################################################################
+
+class PyDendroCrossDateDialog(QDialog):
+  """Rank candidate shifts of a sample against a reference stack."""
+
+  max_results = 20
+
+  def __init__(self, parent, ui, model, sample):
+
+    super(QDialog, self).__init__(parent)
+
+    self.ui = ui
+    self.model = model
+    self.sample = sample
+    self.results = []
+
+    self.setWindowTitle("Cross-date " + sample)
+    self.setMinimumSize(500, 400)
+
+    vbox = QVBoxLayout()
+
+    hbox = QHBoxLayout()
+    hbox.addWidget(QLabel("Reference stack "))
+    self.stack_combo = QComboBox()
+    for stack in sorted(self.model.stacks):
+      self.stack_combo.addItem(stack)
+    index = self.stack_combo.findText('MASTER')
+    if index >= 0:
+      self.stack_combo.setCurrentIndex(index)
+    hbox.addWidget(self.stack_combo)
+
+    hbox.addWidget(QLabel(" minimum overlap "))
+    self.overlap_spin = QSpinBox()
+    self.overlap_spin.setRange(3, 1000)
+    self.overlap_spin.setValue(50)
+    hbox.addWidget(self.overlap_spin)
+
+    scan_button = QPushButton("Scan")
+    self.connect(scan_button, SIGNAL("clicked()"), self.on_scan)
+    hbox.addWidget(scan_button)
+
+    vbox.addLayout(hbox)
+
+    self.table = QTableWidget(0, 5)
+    self.table.setHorizontalHeaderLabels(["Shift", "First year", "Overlap", "r", "t"])
+    self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+    self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+    self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+    vbox.addWidget(self.table)
+
+    bbox = QDialogButtonBox()
+    bbox.addButton("Apply shift", QDialogButtonBox.AcceptRole)
+    bbox.addButton(QDialogButtonBox.Close)
+    self.connect(bbox, SIGNAL("accepted()"), self.on_accepted)
+    self.connect(bbox, SIGNAL("rejected()"), self.on_rejected)
+
+    vbox.addWidget(bbox)
+
+    self.setLayout(vbox)
+
+    self.on_scan()
+
+
+  def on_scan(self):
+
+    stack = str(self.stack_combo.currentText())
+    if not stack:
+      return
+
+    names = [ name for name in self.model.samples_in_stack(stack) if name != self.sample ]
+    normalization = self.model.normalization
+
+    self.results = []
+    if names:
+      reference = chronology([ self.model.get_sample(name) for name in names ],
+                             normalization, stack)
+      self.results = crossdate(self.model.get_sample(self.sample), reference,
+                               self.overlap_spin.value(), normalization)
+      self.results = self.results[:self.max_results]
+
+    self.table.setRowCount(len(self.results))
+    for row, result in enumerate(self.results):
+      for column, text in enumerate([ '%+d' % result.shift, str(result.first_year),
+                                      str(result.overlap), '%.3f' % result.r, '%.2f' % result.t ]):
+        self.table.setItem(row, column, QTableWidgetItem(text))
+
+    if self.results:
+      self.table.selectRow(0)
+
+
+  def on_accepted(self):
+
+    rows = self.table.selectionModel().selectedRows()
+    if rows:
+      shift = self.results[rows[0].row()].shift
+      if shift:
+        self.model.shift_samples([ self.sample ], shift)
 
     self.accept()
 
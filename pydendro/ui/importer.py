@@ -0,0 +1,67 @@
+"""PyDendro background import."""
+# Copyright (c) 2011, Matthew Emmett.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials provided
+#      with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from PyQt4.QtCore import *
+
+from pydendro.bulk import read_many
+
+
+class PyDendroImportThread(QThread):
+  """Read RWL/CSV files in a background thread.
+
+  A loaded(PyQt_PyObject) signal carrying a pydendro.bulk.ReadResult is
+  emitted as each file is read.  Connected slots of objects living in
+  the GUI thread are queued, so stacks can be added to the model as
+  they arrive while the GUI stays responsive.  Calling *cancel* stops
+  the import after the file(s) being read.
+  """
+
+  def __init__(self, paths, parent=None):
+    QThread.__init__(self, parent)
+
+    self.paths = list(paths)
+    self.cancelled = False
+
+
+  def cancel(self):
+    """Stop importing."""
+
+    self.cancelled = True
+
+
+  def run(self):
+
+    results = read_many(self.paths, cache=True)
+    try:
+      for result in results:
+        if self.cancelled:
+          break
+        self.emit(SIGNAL('loaded(PyQt_PyObject)'), result)
+    finally:
+      results.close()
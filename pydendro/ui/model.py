@@ -27,22 +27,199 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
-import os, os.path, string
+import numpy as np
 
-from pydendro import rwl
-from pydendro.sample import Sample
+from collections import namedtuple, OrderedDict
+
+from pydendro import bulk, rwl
+from pydendro.normalize import normalize_many
+from pydendro.intervals import IntervalIndex
 from pydendro.stack import Stack
 
 
+###############################################################################
+# model change events
+
+SAMPLES_SHIFTED    = 'samples shifted'      # ids: sample names
+SAMPLES_EDITED     = 'samples edited'       # ids: sample names
+MEMBERSHIP_CHANGED = 'membership changed'   # ids: stack names
+STACKS_CHANGED     = 'stacks changed'       # ids: added/removed stack names
+STACKS_RENAMED     = 'stacks renamed'       # ids: (old, new) stack names
+NORMALIZATION_CHANGED = 'normalization changed'   # ids: none
+
+PyDendroModelEvent = namedtuple('PyDendroModelEvent', [ 'kind', 'ids' ])
+
+
+class PyDendroEventBus(object):
+  """Model change notifications.
+
+  Events emitted in a burst are coalesced: the affected ids of each
+  kind of event are merged, and listeners are called once with the
+  list of merged events.  If *schedule* is set (eg, to a zero timeout
+  Qt timer) it is called with the flush function on the first event
+  of a burst, so that listeners are notified once per event loop
+  tick; otherwise listeners are notified right away.
+  """
+
+  def __init__(self):
+    self.schedule = None
+    self._listeners = []
+    self._pending = {}
+    self._order = []
+
+
+  def connect(self, listener):
+    """Call listener(events) on model changes."""
+
+    self._listeners.append(listener)
+
+
+  def disconnect(self, listener):
+    """Stop calling listener."""
+
+    if listener in self._listeners:
+      self._listeners.remove(listener)
+
+
+  def emit(self, kind, ids):
+    """Note that the objects *ids* were changed by an event of *kind*."""
+
+    burst = not self._pending
+
+    if kind not in self._pending:
+      self._pending[kind] = set()
+      self._order.append(kind)
+    self._pending[kind].update(ids)
+
+    if burst:
+      if self.schedule is not None:
+        self.schedule(self.flush)
+      else:
+        self.flush()
+
+
+  def flush(self):
+    """Notify listeners of pending events."""
+
+    if not self._pending:
+      return
+
+    events = [ PyDendroModelEvent(kind, frozenset(self._pending[kind])) for kind in self._order ]
+    self._pending = {}
+    self._order = []
+
+    for listener in list(self._listeners):
+      listener(events)
+
+
+###############################################################################
+# normalized ring widths
+
+class PyDendroNormalizationCache(object):
+  """Cache of normalized ring widths.
+
+  Entries are keyed by sample identity and normalization method, and
+  remember the version of the sample they were computed from (see
+  pydendro.sample.Sample), so only editing a sample's widths makes
+  its entries stale; shifting a sample does not.  Results are stored
+  relative to the end of the sample, which is where normalizations
+  that shorten a series align their output.
+
+  Least recently used entries are evicted once the results take more
+  than *budget* bytes.
+  """
+
+  def __init__(self, budget=64*2**20):
+    self.budget = budget
+    self.size = 0
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()       # (id, method) -> (sample, version, widths)
+
+
+  def __len__(self):
+    return len(self._entries)
+
+
+  def _valid(self, sample, method):
+    entry = self._entries.get((id(sample), method))
+    return entry is not None and entry[0] is sample and entry[1] == sample.version
+
+
+  def _store(self, sample, method, widths):
+    key = (id(sample), method)
+    entry = self._entries.pop(key, None)
+    if entry is not None:
+      self.size -= entry[2].nbytes
+
+    self._entries[key] = (sample, sample.version, widths)
+    self.size += widths.nbytes
+
+
+  def get(self, sample, method):
+    """Return the widths of *sample* normalized by *method*."""
+
+    key = (id(sample), method)
+
+    if self._valid(sample, method):
+      self.hits += 1
+      self._entries[key] = entry = self._entries.pop(key)
+      return entry[2]
+
+    self.misses += 1
+    widths = np.asarray(method(sample.widths), dtype=np.float64)
+    self._store(sample, method, widths)
+    self.evict()
+
+    return widths
+
+
+  def fill(self, samples, method):
+    """Normalize the *samples* that are not cached yet in one batch."""
+
+    stale = [ sample for sample in samples if not self._valid(sample, method) ]
+    if not stale:
+      return
+
+    self.misses += len(stale)
+    results = normalize_many([ sample.widths for sample in stale ], method)
+    for sample, widths in zip(stale, results):
+      self._store(sample, method, widths)
+    self.evict()
+
+
+  def evict(self):
+    """Evict least recently used entries until within budget."""
+
+    while self.size > self.budget and len(self._entries) > 1:
+      key, entry = self._entries.popitem(last=False)
+      self.size -= entry[2].nbytes
+
+
+  def clear(self):
+    self._entries.clear()
+    self.size = 0
+
+
+###############################################################################
+
 class PyDendroModel(object):
 
   def __init__(self):
 
     self.ui = None
+    self.events = PyDendroEventBus()
     self._stacks = {}
     self._samples = {}
 
-    self.normalization = None
+    # names of the stacks each sample is in
+    self._membership = {}
+
+    # first/last years of all samples
+    self.intervals = IntervalIndex()
+
+    self._normalization = None
+    self.normalized = PyDendroNormalizationCache()
 
 
   def add_stack(self, stack):
@@ -50,6 +227,8 @@ class PyDendroModel(object):
     
     if stack.name not in self._stacks and stack.name != 'TRASH':
       self._stacks[stack.name] = stack
+      self._add_members(stack.name, stack.samples)
+      self.events.emit(STACKS_CHANGED, [ stack.name ])
     else:
       raise ValueError('stack already exists')
 
@@ -57,30 +236,106 @@ class PyDendroModel(object):
   def remove_stack(self, stack):
     """Remove a stack."""
     
-    if stack != 'TRASH':
-      try:
-        del self._stacks[stack]
-      except:
-        pass
+    if stack != 'TRASH' and stack in self._stacks:
+      self._remove_members(stack, self._stacks[stack].samples)
+      del self._stacks[stack]
+      self.events.emit(STACKS_CHANGED, [ stack ])
 
 
   def rename_stack(self, old, new):
     """Rename a stack."""
     
     if new not in self._stacks and new != 'TRASH':
-      try:
-        self._stacks[new] = self._stacks[old]
-        del self._stacks[old]
-      except:
-        pass
+      if old in self._stacks:
+        stack = self._stacks.pop(old)
+        self._remove_members(old, stack.samples)
+        stack.name = new
+        self._stacks[new] = stack
+        self._add_members(new, stack.samples)
+        self.events.emit(STACKS_RENAMED, [ (old, new) ])
     else:
       raise ValueError('stack already exists')
 
 
+  def _add_members(self, stack, samples):
+    """Record that *samples* (names) are in *stack* (name)."""
+
+    for sample in samples:
+      self._membership.setdefault(sample, set()).add(stack)
+
+
+  def _remove_members(self, stack, samples):
+    """Record that *samples* (names) are no longer in *stack* (name)."""
+
+    for sample in samples:
+      stacks = self._membership.get(sample)
+      if stacks is not None:
+        stacks.discard(stack)
+        if not stacks:
+          del self._membership[sample]
+
+
   def add_sample(self, sample):
     """Add a new sample object."""
     
     self._samples[sample.name] = sample
+    self.intervals.add(sample.name, sample.fyog, sample.lyog)
+
+
+  def shift_samples(self, samples, years):
+    """Shift samples (names) by the given number of years."""
+
+    samples = list(samples)
+    for name in samples:
+      sample = self._samples[name]
+      sample.fyog += years
+      self.intervals.update(name, sample.fyog, sample.lyog)
+
+    self.events.emit(SAMPLES_SHIFTED, samples)
+
+
+  def sample_edited(self, name):
+    """Note that the ring widths of sample *name* were edited."""
+
+    sample = self._samples[name]
+    sample.touch()
+    self.intervals.update(name, sample.fyog, sample.lyog)
+    self.events.emit(SAMPLES_EDITED, [ name ])
+
+
+  @property
+  def normalization(self):
+    """Normalization method applied to plotted samples (or None)."""
+
+    return self._normalization
+
+  @normalization.setter
+  def normalization(self, normalization):
+    if normalization is not self._normalization:
+      self._normalization = normalization
+      self.events.emit(NORMALIZATION_CHANGED, [])
+
+
+  def prepare_plot_widths(self, names):
+    """Normalize the samples *names* (if need be) in one batch."""
+
+    if self._normalization is not None:
+      self.normalized.fill([ self._samples[name] for name in names ], self._normalization)
+
+
+  def plot_widths(self, name):
+    """Return (first year, ring widths) of sample *name* as plotted.
+
+    The ring widths are normalized by the current normalization (if
+    any) and aligned to the last year of the sample.
+    """
+
+    sample = self._samples[name]
+    if self._normalization is None:
+      return sample.fyog, sample.widths
+
+    widths = self.normalized.get(sample, self._normalization)
+    return sample.lyog - len(widths) + 1, widths
 
 
   @property
@@ -110,41 +365,61 @@ class PyDendroModel(object):
 
 
   def samples_in_stack(self, stack):
-    """Return list of samples in stack."""
+    """Return (read-only) set of samples in stack."""
     
-    return list(self._stacks[stack].samples)
+    return self._stacks[stack].samples
+
+
+  def stacks_of_sample(self, sample):
+    """Return set of stacks that sample is in."""
+
+    return frozenset(self._membership.get(sample, ()))
   
 
   def move_sample(self, source, sample, destination):
     """Move sample from source stack to destination stack."""
 
-    if destination == 'TRASH':
-      try:
-        src = self._stacks[source]
-        src.remove_sample(sample)
-      except:
-        pass
-
-      return
-
-    try:
-      src = self._stacks[source]
-      dst = self._stacks[destination]
-      dst.add_sample(sample)
-      src.remove_sample(sample)
-    except:
-      pass
+    self.move_samples(source, [ sample ], destination)
 
 
   def copy_sample(self, source, sample, destination):
     """Copy sample from source stack to destination stack."""
     
-    try:
-      src = self._stacks[source]
-      dst = self._stacks[destination]
-      dst.add_sample(sample)
-    except:
-      pass
+    self.copy_samples(source, [ sample ], destination)
+
+
+  def move_samples(self, source, samples, destination):
+    """Move samples from source stack to destination stack.
+
+    Moving to the TRASH removes the samples from the source stack.
+    """
+
+    if source not in self._stacks or source == destination:
+      return
+
+    if destination != 'TRASH':
+      if destination not in self._stacks:
+        return
+      self.copy_samples(source, samples, destination)
+
+    src = self._stacks[source]
+    removed = [ sample for sample in samples if sample in src ]
+    src.remove_samples(removed)
+    self._remove_members(source, removed)
+    self.events.emit(MEMBERSHIP_CHANGED, [ source ])
+
+
+  def copy_samples(self, source, samples, destination):
+    """Copy samples from source stack to destination stack."""
+
+    if source not in self._stacks or destination not in self._stacks:
+      return
+
+    dst = self._stacks[destination]
+    added = [ sample for sample in set(samples) if sample not in dst ]
+    dst.add_samples(added)
+    self._add_members(destination, added)
+    self.events.emit(MEMBERSHIP_CHANGED, [ destination ])
 
 
   # def delete_sample(self, source, sample, destination):
@@ -160,7 +435,11 @@ class PyDendroModel(object):
   def add_stack_from_rwl(self, filename):
     """Create a new from an RWL file."""
     
-    stack_name = string.split(os.path.basename(filename), '.')[0]
+    return self.add_stack_from_samples(bulk.stack_name(filename), rwl.read(filename, cache=True))
+
+
+  def add_stack_from_samples(self, stack_name, plain_samples):
+    """Create a new stack from a list of samples."""
 
     # check stack name
     # XXX
@@ -169,12 +448,7 @@ class PyDendroModel(object):
                       "Stack %s already exists.  Skipping import." % stack_name)
       return
 
-    # load samples
-    samples = []
-    for s in rwl.read(filename):
-      sample = Sample()
-      sample.from_plain(s)
-      samples.append(sample)
+    samples = list(plain_samples)
 
     # check samples
     # for sample in samples:
@@ -184,7 +458,7 @@ class PyDendroModel(object):
 
     # add samples
     for sample in samples:
-      self._samples[str(sample)] = sample
+      self.add_sample(sample)
 
     # add stack
     stack = Stack()
@@ -0,0 +1,295 @@
+"""PyDendro plot renderer."""
+# Copyright (c) 2011, Matthew Emmett.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials provided
+#      with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import numpy as np
+
+from matplotlib.lines import Line2D
+
+from pydendro.lod import MinMaxPyramid
+
+
+class PyDendroRenderer(object):
+  """Incremental sample plot renderer.
+
+  Each visible sample is drawn by one persistent Line2D artist.
+  Calling *render* with the samples that should be visible removes
+  the artists of samples that went away, creates artists for new
+  samples and restyles artists whose colour or selection state
+  changed; artists of unchanged samples are left alone.  Shifted or
+  edited samples are refreshed in place with *update_data*.
+
+  Lines are fed decimated data from a min/max pyramid of each sample
+  (see pydendro.lod), just detailed enough for the current x limits
+  and the width of the axes in pixels.  Changing the x limits (eg,
+  zooming or panning) or resizing the canvas re-decimates the lines.
+
+  Picking is done by the renderer rather than by matplotlib's per
+  artist hit testing: the plotted samples are filed in a uniform grid
+  of year buckets, so a click only has to be checked against the few
+  samples in the bucket of the clicked year (see *pick*).
+  """
+
+  pick_tolerance = { False: 5, True: 10 }   # pixels, by selection state
+  bucket_years   = 1                        # years per pick bucket
+
+  def __init__(self, axes, model):
+    self.axes = axes
+    self.model = model
+    self.lines = {}                     # sample name -> Line2D
+    self.styles = {}                    # sample name -> (color, selected)
+    self.pyramids = {}                  # sample name -> MinMaxPyramid
+    self.offsets = {}                   # sample name -> first plotted year - fyog
+    self.extents = {}                   # sample name -> (first, last) plotted years
+    self.buckets = {}                   # year bucket -> sample names
+
+    self.axes.callbacks.connect('xlim_changed', self.on_view_changed)
+    self.axes.figure.canvas.mpl_connect('resize_event', self.on_view_changed)
+
+
+  def render(self, visible):
+    """Make the plotted samples match *visible*.
+
+    *visible* maps sample names to (color, selected) pairs.  Return
+    True if any artists were created, removed or restyled.
+    """
+
+    changed = False
+
+    for name in set(self.lines) - set(visible):
+      self.lines.pop(name).remove()
+      del self.styles[name]
+      del self.pyramids[name]
+      del self.offsets[name]
+      self.unindex(name)
+      changed = True
+
+    self.model.prepare_plot_widths([ name for name in visible if name not in self.lines ])
+
+    for name, style in visible.items():
+      if name not in self.lines:
+        self.load(name)
+        line = Line2D(*self.decimate(name), label=name)
+        self.axes.add_line(line)
+        self.lines[name] = line
+      elif self.styles[name] == style:
+        continue
+
+      self.set_style(self.lines[name], *style)
+      self.styles[name] = style
+      changed = True
+
+    if changed:
+      self.rescale()
+
+    return changed
+
+
+  def set_style(self, line, color, selected):
+    """Set line style according to selection state."""
+
+    if selected:
+      line.set_color('r')
+      line.set_marker('.')
+      line.set_linewidth(2)
+      line.set_zorder(3)
+    else:
+      line.set_color(color)
+      line.set_marker('None')
+      line.set_linewidth(1)
+      line.set_zorder(2)
+
+
+  def update_data(self, names=None):
+    """Refresh the data of plotted samples *names* (default: all)."""
+
+    if names is None:
+      names = list(self.lines)
+
+    self.model.prepare_plot_widths([ name for name in names if name in self.lines ])
+
+    changed = False
+    for name in names:
+      line = self.lines.get(name)
+      if line is not None:
+        self.load(name)
+        line.set_data(*self.decimate(name))
+        changed = True
+
+    if changed:
+      self.rescale()
+
+    return changed
+
+
+  def shift(self, names):
+    """Move plotted samples *names* to their new years.
+
+    Shifting leaves the plotted ring widths alone, so the pyramids are
+    kept and only the extents and line data are updated.
+    """
+
+    changed = False
+    for name in names:
+      line = self.lines.get(name)
+      if line is not None:
+        first = self.first_year(name)
+        self.index(name, first, first + len(self.pyramids[name]) - 1)
+        line.set_data(*self.decimate(name))
+        changed = True
+
+    if changed:
+      self.rescale()
+
+    return changed
+
+
+  def load(self, name):
+    """Build the pyramid of the plotted ring widths of sample *name*.
+
+    Plotted widths are normalized (see PyDendroModel.plot_widths).
+    """
+
+    sample = self.model.get_sample(name)
+    first, widths = self.model.plot_widths(name)
+
+    self.pyramids[name] = MinMaxPyramid(widths)
+    self.offsets[name] = first - sample.fyog
+    self.index(name, first, first + len(widths) - 1)
+
+
+  def index(self, name, first, last):
+    """File sample *name* under its plotted years [first, last]."""
+
+    if name in self.extents:
+      self.unindex(name)
+
+    self.extents[name] = (first, last)
+    for bucket in range(first // self.bucket_years, last // self.bucket_years + 1):
+      self.buckets.setdefault(bucket, set()).add(name)
+
+
+  def unindex(self, name):
+    """Remove sample *name* from the extents and year buckets."""
+
+    first, last = self.extents.pop(name)
+    for bucket in range(first // self.bucket_years, last // self.bucket_years + 1):
+      names = self.buckets[bucket]
+      names.discard(name)
+      if not names:
+        del self.buckets[bucket]
+
+
+  def first_year(self, name):
+    """Return the first plotted year of sample *name*."""
+
+    return self.model.get_sample(name).fyog + self.offsets[name]
+
+
+  def decimate(self, name):
+    """Return decimated (years, widths) of sample *name* for the current view."""
+
+    first, last = self.axes.get_xlim()
+    pixels = self.axes.bbox.width
+    return self.pyramids[name].decimate(self.first_year(name),
+                                        first, last, pixels)
+
+
+  def on_view_changed(self, event):
+    """Re-decimate all lines for new x limits or canvas size."""
+
+    for name, line in self.lines.items():
+      line.set_data(*self.decimate(name))
+
+
+  def pick(self, x, y):
+    """Return the name of the plotted sample closest to the display point (x, y).
+
+    Candidates are the samples in the year buckets of the clicked year
+    that cover it.  Their ring widths are interpolated at the clicked
+    year and the closest one within the pick tolerance (in pixels) is
+    returned, or None.
+    """
+
+    transform = self.axes.transData
+    year, width = transform.inverted().transform((x, y))
+
+    lo, hi = int(np.floor(year)), int(np.ceil(year))
+    candidates = set()
+    for bucket in range(lo // self.bucket_years, hi // self.bucket_years + 1):
+      candidates.update(self.buckets.get(bucket, ()))
+
+    best, distance = None, None
+    for name in sorted(candidates):
+      first, last = self.extents[name]
+      if last < lo or first > hi:
+        continue
+      # interpolate between the rings either side of the clicked year
+      widths = self.pyramids[name].widths
+      i = min(max(lo - first, 0), len(widths) - 1)
+      j = min(i + 1, len(widths) - 1)
+      t = min(max(year - first - i, 0.0), 1.0)
+      w = widths[i] + (widths[j] - widths[i]) * t
+      d = abs(transform.transform((year, w))[1] - y)
+      if d <= self.pick_tolerance[self.styles[name][1]] and (best is None or d < distance):
+        best, distance = name, d
+
+    return best
+
+
+  def rescale(self):
+    """Rescale the axes to fit the plotted samples.
+
+    The data limits are taken from the full samples rather than the
+    (decimated) line data.
+    """
+
+    corners = []
+    for name, pyramid in self.pyramids.items():
+      if len(pyramid):
+        first = self.first_year(name)
+        ymin, ymax = pyramid.extent
+        corners += [ (first, ymin), (first + len(pyramid) - 1, ymax) ]
+
+    if corners:
+      self.axes.ignore_existing_data_limits = True
+      self.axes.update_datalim(corners)
+      self.axes.autoscale_view()
+
+
+  def clear(self):
+    """Remove all sample artists."""
+
+    for line in self.lines.values():
+      line.remove()
+    self.lines = {}
+    self.styles = {}
+    self.pyramids = {}
+    self.offsets = {}
+    self.extents = {}
+    self.buckets = {}
@@ -26,39 +26,184 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+import numpy as np
+
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
+from pydendro.ui.model import (SAMPLES_SHIFTED, SAMPLES_EDITED, MEMBERSHIP_CHANGED,
+                               STACKS_CHANGED, STACKS_RENAMED)
+
+
+def row_runs(rows):
+  """Split sorted *rows* into (first, last) runs of consecutive rows."""
+
+  runs = []
+  for row in rows:
+    if runs and runs[-1][1] == row - 1:
+      runs[-1][1] = row
+    else:
+      runs.append([ row, row ])
+  return [ tuple(run) for run in runs ]
+
+
+class PyDendroSampleTableModel(QAbstractTableModel):
+  """Year/width table of a sample for the sample editor.
+
+  Cells are read straight from the sample's ring width array.  Edits
+  update the array in place and emit dataChanged for the edited
+  cell(s); inserting and deleting rings emit row insert/remove
+  signals, so the view never rebuilds the whole table.
+  """
+
+  def __init__(self, model, sample, parent=None):
+    QAbstractTableModel.__init__(self, parent)
+    self.model = model
+    self.sample = sample
+
+
+  def rowCount(self, parent=QModelIndex()):
+    if parent.isValid():
+      return 0
+    return self.sample.nyears
+
+
+  def columnCount(self, parent=QModelIndex()):
+    if parent.isValid():
+      return 0
+    return 2
+
+
+  def data(self, index, role=Qt.DisplayRole):
+    if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+      return QVariant()
+
+    if index.column() == 0:
+      return QVariant(str(self.sample.first_year + index.row()))
+    return QVariant(str(self.sample.ring_widths[index.row()]))
+
+
+  def headerData(self, section, orientation, role=Qt.DisplayRole):
+    if role != Qt.DisplayRole:
+      return QVariant()
+
+    if orientation == Qt.Horizontal:
+      return QVariant(["Year", "Width"][section])
+    return QVariant(str(section + 1))
+
+
+  def flags(self, index):
+    flags = QAbstractTableModel.flags(self, index)
+    if index.isValid() and index.column() == 1:
+      flags |= Qt.ItemIsEditable
+    return flags
+
+
+  def setData(self, index, value, role=Qt.EditRole):
+    if not index.isValid() or index.column() != 1 or role != Qt.EditRole:
+      return False
+
+    if isinstance(value, QVariant):
+      value = value.toString()
+
+    try:
+      self.sample.ring_widths[index.row()] = float(str(value))
+    except ValueError:
+      return False
+
+    self.model.sample_edited(self.sample.name)
+    self.dataChanged.emit(index, index)
+    return True
+
+
+  def delete_rings(self, row, count=1):
+    """Delete *count* rings starting at *row*."""
+
+    count = min(count, self.sample.nyears - row)
+    if row < 0 or count <= 0:
+      return
+
+    self.beginRemoveRows(QModelIndex(), row, row + count - 1)
+    self.sample.ring_widths = np.delete(self.sample.ring_widths, range(row, row + count))
+    self.endRemoveRows()
+    self.model.sample_edited(self.sample.name)
+
+
+  def insert_rings(self, row, count=1):
+    """Insert *count* zero width rings before *row*."""
+
+    row = max(0, min(row, self.sample.nyears))
+
+    self.beginInsertRows(QModelIndex(), row, row + count - 1)
+    self.sample.ring_widths = np.insert(self.sample.ring_widths, row, np.zeros(count))
+    self.endInsertRows()
+    self.model.sample_edited(self.sample.name)
+
+
+  def paste(self, row, widths):
+    """Overwrite rings from *row* on with *widths*, appending rings as needed."""
+
+    widths = np.asarray(widths, dtype=np.float64)
+    if not len(widths):
+      return
+
+    row = max(0, min(row, self.sample.nyears))
+    extra = row + len(widths) - self.sample.nyears
+    if extra > 0:
+      self.beginInsertRows(QModelIndex(), self.sample.nyears, self.sample.nyears + extra - 1)
+      self.sample.ring_widths = np.append(self.sample.ring_widths, np.zeros(extra))
+      self.endInsertRows()
+
+    self.sample.ring_widths[row:row+len(widths)] = widths
+    self.model.sample_edited(self.sample.name)
+    self.dataChanged.emit(self.index(row, 1), self.index(row + len(widths) - 1, 1))
+
+
+def parse_widths(text):
+  """Parse pasted ring widths (the last column of each line) from *text*."""
+
+  widths = []
+  for line in text.splitlines():
+    fields = line.replace(',', ' ').split()
+    if fields:
+      widths.append(float(fields[-1]))
+  return widths
+
+
 class PyDendroSampleEdtior(QDialog):
 
   def __init__(self, parent, ui, model, sample):
     super(QDialog, self).__init__(parent)
     self.ui = ui
-    self.populating = False
+    self.model = model
     self.sample = model.get_sample(sample)
+    self.table_model = PyDendroSampleTableModel(model, self.sample, self)
     self.create_dialog()
-    self.populate()
 
   def create_dialog(self):
     self.setWindowTitle("Sample editor: " + self.sample.name)
-    self.table = QTableWidget(self)
-    self.table.setColumnCount(2)
-    self.table.setHorizontalHeaderLabels(["Year", "Width"])
+    self.table = QTableView(self)
+    self.table.setModel(self.table_model)
+    self.table.verticalHeader().setResizeMode(QHeaderView.Fixed)
 
     self.delete_button = QPushButton('Delete')
     self.insert_after_button = QPushButton('Insert after')
     self.insert_before_button = QPushButton('Insert before')
+    self.paste_button = QPushButton('Paste')
 
     self.delete_button.clicked.connect(self.on_delete)
     self.insert_after_button.clicked.connect(self.on_insert_after)
     self.insert_before_button.clicked.connect(self.on_insert_before)
+    self.paste_button.clicked.connect(self.on_paste)
+
+    paste = QShortcut(QKeySequence.Paste, self.table)
+    paste.activated.connect(self.on_paste)
 
     abox = QHBoxLayout()
     abox.addWidget(self.delete_button)
     abox.addWidget(self.insert_after_button)
     abox.addWidget(self.insert_before_button)
-
-    self.connect(self.table, SIGNAL('itemChanged (QTableWidgetItem*)'), self.on_changed)
+    abox.addWidget(self.paste_button)
 
     bbox = QHBoxLayout()
     self.close_button = QPushButton('Close')
@@ -72,71 +217,120 @@ class PyDendroSampleEdtior(QDialog):
     self.resize(400, 800)
     self.setLayout(vbox)
 
-  def populate(self):
-    self.populating = True
-    self.table.setRowCount(self.sample.nyears)
-    for i, width in enumerate(self.sample.ring_widths):
-      year = QTableWidgetItem(str(self.sample.first_year + i))
-      width = QTableWidgetItem(str(width))
-      self.table.setItem(i, 0, year)
-      self.table.setItem(i, 1, width)
-    self.populating = False
-
-
-  def on_changed(self):
-    if not self.populating:
-      row = self.table.currentRow()
-      col = self.table.currentColumn()
-      if col == 1:
-        try:
-          value = float(self.table.item(row, col).text())
-          self.sample.ring_widths[row] = value
-        except:
-          pass
-      self.populate()
+  @property
+  def current_row(self):
+    return self.table.currentIndex().row()
 
   def on_delete(self):
-    idx = self.table.currentRow()
-    del self.sample.ring_widths[idx]
-    self.populate()
+    rows = sorted(set(index.row() for index in self.table.selectionModel().selectedIndexes()))
+    if not rows:
+      rows = [ self.current_row ]
+    for first, last in reversed(row_runs(rows)):
+      self.table_model.delete_rings(first, last - first + 1)
 
 
   def on_insert_after(self):
-    idx = self.table.currentRow()
-    self.sample.ring_widths.insert(idx+1, 0.0)
-    self.populate()
+    self.table_model.insert_rings(self.current_row + 1)
 
 
   def on_insert_before(self):
-    idx = self.table.currentRow()
-    self.sample.ring_widths.insert(idx, 0.0)
-    self.populate()
+    self.table_model.insert_rings(max(self.current_row, 0))
+
+
+  def on_paste(self):
+    """Paste ring widths from the clipboard, starting at the current row."""
+
+    try:
+      widths = parse_widths(str(QApplication.clipboard().text()))
+    except ValueError as e:
+      QMessageBox.warning(self, "Paste failed", "Unable to parse ring widths: %s" % e)
+      return
+
+    self.table_model.paste(max(self.current_row, 0), widths)
 
 
   def on_accepted(self):
-    self.ui.on_draw()
     self.accept()
 
 
-class PyDendroSampleListItem(QListWidgetItem):
+class PyDendroSampleListModel(QAbstractListModel):
+  """Sorted list of sample names shown by a stack view.
+
+  Labels (the sample name and its shift, if any) are computed when
+  the view asks for them, so only visible rows cost anything.
+  *set_samples* inserts and removes runs of rows (keeping the
+  selection of the other rows), and *samples_changed* emits
+  dataChanged for the runs of rows that need relabelling.
+  """
+
+  def __init__(self, model, parent=None):
+    QAbstractListModel.__init__(self, parent)
 
-  def __init__(self, name, model):
-    super(PyDendroSampleListItem, self).__init__(name)
-    self.name = name
     self.model = model
-    self.update()
+    self.names = []
+    self.rows = {}
+
+
+  def rowCount(self, parent=QModelIndex()):
+    if parent.isValid():
+      return 0
+    return len(self.names)
+
+
+  def data(self, index, role=Qt.DisplayRole):
+    if not index.isValid() or index.row() >= len(self.names):
+      return QVariant()
+
+    name = self.names[index.row()]
+
+    if role == Qt.DisplayRole:
+      sample = self.model.get_sample(name)
+      if sample.first_year != sample.original_first_year:
+        return QVariant(name + ' (' + str(sample.first_year-sample.original_first_year) + ')')
+      return QVariant(name)
+
+    if role == Qt.UserRole:
+      return QVariant(name)
+
+    return QVariant()
 
-  def update(self):
-    sample = self.model.get_sample(self.name)
 
-    if sample.first_year != sample.original_first_year:
-      self.setText(self.name + ' (' + str(sample.first_year-sample.original_first_year) + ')')
+  def set_samples(self, names):
+    """Show the samples *names*."""
+
+    names = sorted(names)
+
+    if not self.names or not names:
+      self.beginResetModel()
+      self.names = names
+      self.endResetModel()
+
     else:
-      self.setText(self.name)
-      
+      new = set(names)
+      removed = [ row for row, name in enumerate(self.names) if name not in new ]
+      for first, last in reversed(row_runs(removed)):
+        self.beginRemoveRows(QModelIndex(), first, last)
+        del self.names[first:last+1]
+        self.endRemoveRows()
+
+      # the remaining names are in order within names, so inserting
+      # runs of new names at their final rows, top down, yields names
+      old = set(self.names)
+      added = [ row for row, name in enumerate(names) if name not in old ]
+      for first, last in row_runs(added):
+        self.beginInsertRows(QModelIndex(), first, last)
+        self.names[first:first] = names[first:last+1]
+        self.endInsertRows()
+
+    self.rows = { name: row for row, name in enumerate(self.names) }
 
-class PyDendroSampleList(QListWidget):
-  pass
+
+  def samples_changed(self, names):
+    """Relabel the samples *names*."""
+
+    rows = sorted(self.rows[name] for name in names if name in self.rows)
+    for first, last in row_runs(rows):
+      self.dataChanged.emit(self.index(first), self.index(last))
 
 class PyDendroStackView(QDockWidget):
 
@@ -152,13 +346,16 @@ class PyDendroStackView(QDockWidget):
     self.stacks = set()
     self.samples = set()
     self.stack_items = {}
-    self.sample_items = {}
+    self.sample_model = PyDendroSampleListModel(model, self)
 
     self.create_stack_view()
 
+    self.model.events.connect(self.on_model_changed)
+
 
   def closeEvent(self, ev):
     super(QDockWidget, self).closeEvent(ev)
+    self.model.events.disconnect(self.on_model_changed)
     self.ui.delete_stack_view(self)
 
 
@@ -170,7 +367,17 @@ class PyDendroStackView(QDockWidget):
 
   @property
   def selected_samples(self):
-    return [item.name for item in self.sample_list.selectedItems()]
+    names = self.sample_model.names
+    return [names[index.row()] for index in self.sample_list.selectionModel().selectedIndexes()]
+
+
+  def toggle_sample(self, name):
+    """Toggle the selection of sample *name* (if shown)."""
+
+    row = self.sample_model.rows.get(name)
+    if row is not None:
+      self.sample_list.selectionModel().select(self.sample_model.index(row),
+                                               QItemSelectionModel.Toggle)
 
 
   def set_color(self, color):
@@ -207,33 +414,66 @@ class PyDendroStackView(QDockWidget):
         self.destination_combo.addItem(stack)
           
     for stack in (old_stacks - new_stacks):
-      self.stack_list.takeItem(self.stack_list.row(self.stack_items[stack]))
+      self.stack_list.takeItem(self.stack_list.row(self.stack_items.pop(stack)))
+      index = self.destination_combo.findText(stack)
+      if index >= 0:
+        self.destination_combo.removeItem(index)
 
     self.stacks = new_stacks
 
 
+  def rename_stack_item(self, old, new):
+    """Rename stack list item."""
+
+    item = self.stack_items.pop(old)
+    item.setText(new)
+    self.stack_items[new] = item
+
+    self.stacks.discard(old)
+    self.stacks.add(new)
+
+    index = self.destination_combo.findText(old)
+    if index >= 0:
+      self.destination_combo.setItemText(index, new)
+
+
   def update_samples(self):
     """Update sample list."""
     
-    old_samples = self.samples
     new_samples = set()
-
     for stack in self.selected_stacks:
-      samples = self.filter(self.model.samples_in_stack(stack))
+      new_samples.update(self.filter(self.model.samples_in_stack(stack)))
+
+    if new_samples != self.samples:
+      self.sample_model.set_samples(new_samples)
+      self.samples = new_samples
+
 
-      for sample in samples:
-        new_samples.add(sample)
-        if sample not in old_samples:
-          self.sample_items[sample] = PyDendroSampleListItem(sample, self.model)
-          self.sample_list.addItem(self.sample_items[sample])
+  def on_model_changed(self, events):
+    """Patch the stack and sample lists after model changes."""
 
-    for sample in (old_samples - new_samples):
-      self.sample_list.takeItem(self.sample_list.row(self.sample_items[sample]))
+    for event in events:
+      if event.kind == STACKS_RENAMED:
+        renames = set(event.ids)
+        while renames:
+          ready = [ (old, new) for old, new in renames
+                    if old in self.stack_items and new not in self.stack_items ]
+          if not ready:
+            break
+          for old, new in ready:
+            self.rename_stack_item(old, new)
+          renames.difference_update(ready)
+        self.update_stacks()
 
-    self.samples = new_samples
+      elif event.kind == STACKS_CHANGED:
+        self.update_stacks()
 
-    for name in self.sample_items:
-      self.sample_items[name].update()
+      elif event.kind == MEMBERSHIP_CHANGED:
+        if event.ids & set(self.selected_stacks):
+          self.update_samples()
+
+      elif event.kind in (SAMPLES_SHIFTED, SAMPLES_EDITED):
+        self.sample_model.samples_changed(event.ids)
 
 
   ##
@@ -242,15 +482,15 @@ class PyDendroStackView(QDockWidget):
 
   def on_stack_selection(self):
     self.update_samples()
-    self.ui.on_draw()
+    self.ui.redraw('stacks')
 
 
-  def on_sample_selection(self):
-    self.ui.on_draw()
+  def on_sample_selection(self, selected=None, deselected=None):
+    self.ui.redraw('selection')
 
 
-  def on_sample_double_clicked(self):
-    sample = self.selected_samples[0]
+  def on_sample_double_clicked(self, index):
+    sample = self.sample_model.names[index.row()]
     dialog = PyDendroSampleEdtior(self, self.ui, self.model, sample)
     dialog.exec_()
 
@@ -262,7 +502,7 @@ class PyDendroStackView(QDockWidget):
 
     if QColor.isValid(color):
       self.set_color(color)
-      self.ui.on_draw()
+      self.ui.redraw('color')
 
   def filter(self, samples):
     
@@ -285,7 +525,7 @@ class PyDendroStackView(QDockWidget):
       self._filter = set(self.selected_samples)
 
     self.update_samples()
-    self.ui.on_draw()
+    self.ui.redraw('filter')
 
 
   def on_commit(self):
@@ -294,20 +534,18 @@ class PyDendroStackView(QDockWidget):
     action = str(self.action_combo.currentText())
 
     if action == "Move to":
-      action = self.model.move_sample
+      action = self.model.move_samples
     elif action == "Copy to":
-      action = self.model.copy_sample
+      action = self.model.copy_samples
     # elif action == "Delete":
     #   action = self.model.delete_sample
     else:
       return
 
     destination = str(self.destination_combo.currentText())
+    samples = self.selected_samples
     for stack in self.selected_stacks:
-      for sample in self.selected_samples:
-        action(stack, sample, destination)
-
-    self.ui.update_stacks()
+      action(stack, samples, destination)
       
 
   ##
@@ -370,11 +608,13 @@ class PyDendroStackView(QDockWidget):
     self.connect(self.hold_button, SIGNAL("clicked()"), self.on_hold)
 
     # sample list
-    self.sample_list = PyDendroSampleList()    
+    self.sample_list = QListView()
+    self.sample_list.setModel(self.sample_model)
+    self.sample_list.setUniformItemSizes(True)
     self.sample_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
-    self.sample_list.setSortingEnabled(True)
-    self.connect(self.sample_list, SIGNAL('itemSelectionChanged()'), self.on_sample_selection)
-    self.connect(self.sample_list, SIGNAL('itemDoubleClicked (QListWidgetItem *)'), self.on_sample_double_clicked)
+    self.connect(self.sample_list.selectionModel(),
+                 SIGNAL('selectionChanged(QItemSelection, QItemSelection)'), self.on_sample_selection)
+    self.connect(self.sample_list, SIGNAL('doubleClicked(QModelIndex)'), self.on_sample_double_clicked)
 
     vbox.addWidget(self.sample_list)
 
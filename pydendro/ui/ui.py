@@ -37,6 +37,9 @@ from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
 from pydendro.stack import Stack
+from pydendro.ui.importer import PyDendroImportThread
+from pydendro.ui.model import SAMPLES_SHIFTED, SAMPLES_EDITED, NORMALIZATION_CHANGED
+from pydendro.ui.renderer import PyDendroRenderer
 from pydendro.ui.stack_view import PyDendroStackView
 from pydendro.ui.dialogs import *
 
@@ -53,8 +56,13 @@ class PyDendroMainWindow(QMainWindow):
     QMainWindow.__init__(self, parent)
     self.setWindowTitle('PyDendro')
 
-    self.hold = False
     self.stack_views = []
+    self.import_thread = None
+
+    # redraw scheduling (see redraw)
+    self.dirty = set()
+    self.redraws = 0
+    self.skipped_redraws = 0
 
     try:
       path = os.environ['PYDENDRO']
@@ -106,7 +114,7 @@ class PyDendroMainWindow(QMainWindow):
   def delete_stack_view(self, stack_view):
     self.stack_views.remove(stack_view)
     self.update_stacks()
-    self.on_draw()
+    self.redraw('stack views')
 
 
   ##
@@ -145,13 +153,72 @@ class PyDendroMainWindow(QMainWindow):
       self, caption="Import samples from RWL file(s)",
       directory=self.working_directory)
 
-    for filename in filenames:
-      filename = str(filename)
-      stack = self.model.add_stack_from_rwl(filename)
-      self.status_text.setText("Loaded %d samples from %s" % (len(stack.samples), filename))
+    filenames = [ str(filename) for filename in filenames ]
+
+    if not filenames:
+      return
+
+    if self.import_thread is not None:
+      self.warning("Import in progress",
+                   "Please wait for the current import to finish.")
+      return
+
+    self.import_errors = []
+
+    self.import_progress = QProgressDialog(
+      "Importing %d file(s)..." % len(filenames), "Cancel", 0, len(filenames), self)
+    self.import_progress.setWindowTitle("Import RWL")
+    self.import_progress.setWindowModality(Qt.NonModal)
+    self.import_progress.setMinimumDuration(500)
+    self.import_progress.setValue(0)
+
+    self.import_thread = PyDendroImportThread(filenames, self)
+    self.connect(self.import_thread, SIGNAL('loaded(PyQt_PyObject)'), self.on_import_loaded)
+    self.connect(self.import_thread, SIGNAL('finished()'), self.on_import_finished)
+    self.connect(self.import_progress, SIGNAL('canceled()'), self.import_thread.cancel)
+    self.import_thread.start()
+
+
+  def on_import_loaded(self, result):
+    """Add a stack read by the import thread."""
+
+    # results queued before the user cancelled are dropped; the
+    # cancelled progress dialog is not advanced (that would show it again)
+    if self.import_thread.cancelled:
+      return
+
+    self.import_progress.setValue(self.import_progress.value() + 1)
+
+    if result.error is not None:
+      self.import_errors.append("%s: %s" % (result.path, result.error))
+      return
+
+    stack = self.model.add_stack_from_samples(result.stack, result.samples)
+    if stack is not None:
+      self.status_text.setText("Loaded %d samples from %s" % (len(stack.samples), result.path))
+
+
+  def on_import_finished(self):
+    """Clean up after the import thread is done."""
+
+    cancelled = self.import_thread.cancelled
+
+    self.import_progress.close()
+    self.import_thread.deleteLater()
+    self.import_thread = None
+
+    if cancelled:
+      self.status_text.setText("Import cancelled")
+
+    if self.import_errors:
+      self.warning("Import failed",
+                   "Unable to import:\n\n" + "\n".join(self.import_errors))
+
 
-    if filenames:
-      self.update_stacks()
+  def warning(self, title, message):
+    """Show a warning message box."""
+
+    QMessageBox.warning(self, title, message)
 
 
   def on_save_stacks(self):
@@ -181,7 +248,6 @@ class PyDendroMainWindow(QMainWindow):
       try:
         stack = Stack(str(new_stack), False)
         self.model.add_stack(stack)
-        self.update_stacks()
       except:
         pass
 
@@ -213,97 +279,95 @@ class PyDendroMainWindow(QMainWindow):
     dialog.exec_()
 
 
+  def on_crossdate(self):
+    """Cross-date dialog."""
+
+    samples = self.selected_samples
+    if len(samples) != 1:
+      self.warning("Cross-date", "Please select one sample to cross-date.")
+      return
+
+    dialog = PyDendroCrossDateDialog(self, self, self.model, samples[0])
+    dialog.exec_()
+
+
   def on_pick(self, event):
     """Pick a transect."""
 
-    self.hold = True
-    
-    line = event.artist
-    sample_name = line.get_label()
+    # leave clicks to the zoom and pan tools, and to other buttons
+    if self.canvas.widgetlock.locked() or event.button != 1:
+      return
 
-    for stack_view in self.stack_views:
-      for item in stack_view.sample_list.findItems(sample_name, Qt.MatchExactly):
-        selected = not stack_view.sample_list.isItemSelected(item)
-        stack_view.sample_list.setItemSelected(item, selected)
+    if event.inaxes is not self.axes or self.renderer is None:
+      return
 
-    self.hold = False
-    self.on_draw()
+    sample_name = self.renderer.pick(event.x, event.y)
+    if sample_name is None:
+      return
+
+    for stack_view in self.stack_views:
+      stack_view.toggle_sample(sample_name)
 
 
   def on_move_left(self):
     """Move selected sample(s) to the left."""
     
-    for sample in self.selected_samples:
-      s = self.model.get_sample(sample)
-      s.first_year -= 1
-
-    self.on_draw()
-
-    for stack_view in self.stack_views:
-      stack_view.update_samples()
-
+    self.model.shift_samples(self.selected_samples, -1)
 
 
   def on_move_right(self):
     """Move selected sample(s) to the right."""
     
-    for sample in self.selected_samples:
-      s = self.model.get_sample(sample)
-      s.first_year += 1
+    self.model.shift_samples(self.selected_samples, 1)
 
-    self.on_draw()
 
-    for stack_view in self.stack_views:
-      stack_view.update_samples()
+  def redraw(self, *dirty):
+    """Schedule a redraw of the plot.
+
+    *dirty* names what changed (eg, 'selection' or 'color').  The plot
+    is redrawn once the event loop is idle, so that any number of
+    redraw requests made in the meantime (eg, by selecting many
+    samples) are coalesced into one; these are counted in
+    *skipped_redraws*.
+    """
+
+    if self.dirty:
+      self.skipped_redraws += 1
+    else:
+      QTimer.singleShot(0, self.on_draw)
+
+    self.dirty.update(dirty or [ 'plot' ])
 
 
   def on_draw(self):
     """Redraw the plot."""
 
-    if self.hold:
-      return
-
-    self.axes.clear()
+    self.dirty = set()
+    self.redraws += 1
 
-    ymin = 9999
-    ymax = 0
+    # each sample is plotted once: selected wins, otherwise the last
+    # stack view showing it sets its colour
 
-    # XXX: don't plot the same sample more than once!
+    visible = {}
 
     for stack_view in self.stack_views:
       selected_stacks  = stack_view.selected_stacks
-      selected_samples = stack_view.selected_samples
+      selected_samples = set(stack_view.selected_samples)
 
       color = stack_view.color.getRgbF()
 
       for stack in selected_stacks:
-        samples = stack_view.filter(self.model.samples_in_stack(stack))
-
-        for sample in samples:
-          if sample not in selected_samples:
-            s = self.model.get_sample(sample)
-            self.axes.plot(s.years, s.ring_widths, '-', color=color,
-                           picker=5, label=sample)
-
-            if max(s.years) > ymax:
-              ymax = max(s.years)
-
-            if min(s.years) < ymin:
-              ymin = min(s.years)
-
-        for sample in samples:
-          if sample in selected_samples:
-            s = self.model.get_sample(sample)
-            self.axes.plot(s.years, s.ring_widths, '.-r',
-                           linewidth=2, picker=10, label=sample)
-
-            if max(s.years) > ymax:
-              ymax = max(s.years)
+        for sample in stack_view.filter(self.model.samples_in_stack(stack)):
+          if sample in visible and visible[sample][1]:
+            continue
+          visible[sample] = (color, sample in selected_samples)
 
-            if min(s.years) < ymin:
-              ymin = min(s.years)
+    if self.renderer is None:
+      self.renderer = PyDendroRenderer(self.axes, self.model)
 
+    self.renderer.render(visible)
 
+    ymin, ymax = self.model.intervals.extent(visible) or (9999, 0)
     ymin = (ymin/10)*10
     ymax = (ymax/10+1)*10
 
@@ -314,16 +378,29 @@ class PyDendroMainWindow(QMainWindow):
       pass
 
     # self.axes.set_xlim([ymin, ymax])
-    self.axes.xaxis.grid(color='gray')#, linestyle='dashed')
-    self.axes.yaxis.grid(color='gray')#, linestyle='dashed')    
     self.canvas.draw()
 
 
+  def on_model_changed(self, events):
+    """Redraw after model changes."""
+
+    if self.renderer is not None:
+      for event in events:
+        if event.kind == SAMPLES_SHIFTED:
+          self.renderer.shift(event.ids)
+        elif event.kind == SAMPLES_EDITED:
+          self.renderer.update_data(event.ids)
+        elif event.kind == NORMALIZATION_CHANGED:
+          self.renderer.update_data()
+
+    self.redraw(*[ event.kind for event in events ])
+
+
   def on_plot_stacks_toggled(self, checked):
     """Trigger redraw."""
 
     self.moveable_stacks = set()
-    self.on_draw()
+    self.redraw()
 
 
   ##
@@ -350,8 +427,11 @@ class PyDendroMainWindow(QMainWindow):
     self.canvas = FigureCanvas(fig)
     self.canvas.setParent(plot_frame)
     self.axes = fig.add_subplot(111,axis_bgcolor=(1.0, 1.0, 1.0, 1.0))
+    self.axes.xaxis.grid(color='gray')#, linestyle='dashed')
+    self.axes.yaxis.grid(color='gray')#, linestyle='dashed')
+    self.renderer = None
     self.cursor = Cursor(self.axes, color='grey', useblit=True)
-    self.canvas.mpl_connect('pick_event', self.on_pick)
+    self.canvas.mpl_connect('button_press_event', self.on_pick)
     vbox.addWidget(self.canvas)
 
     mpl_toolbar = NavigationToolbar(self.canvas, plot_frame)
@@ -443,8 +523,12 @@ class PyDendroMainWindow(QMainWindow):
       "Normali&zation...",
       slot=self.on_normalization, tip="Configure normalization options")
 
+    crossdate_action = self.create_action(
+      "&Cross-date...",
+      slot=self.on_crossdate, tip="Rank shifts of the selected sample against a reference stack")
+
     self.add_actions(self.tools_menu,
-                     (normalization_action,))
+                     (normalization_action, crossdate_action))
     
     # help menu
     self.help_menu = self.menuBar().addMenu("&Help")
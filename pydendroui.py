@@ -39,6 +39,7 @@ def pydendroui():
     from pydendro.stack import Stack
     from pydendro.ui.model import PyDendroModel
     from pydendro.ui.ui import PyDendroMainWindow
+    from PyQt4.QtCore import QTimer
     from PyQt4.QtGui import QApplication
 
     # create application, model and form
@@ -49,6 +50,10 @@ def pydendroui():
     model.ui = ui
     ui.model = model
 
+    # deliver model change events once per event loop tick
+    model.events.schedule = lambda flush: QTimer.singleShot(0, flush)
+    model.events.connect(ui.on_model_changed)
+
     # add default stacks
     stack = Stack('MASTER', False)
     model.add_stack(stack)
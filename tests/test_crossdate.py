@@ -0,0 +1,127 @@
+"""Tests of the lag scan and pairwise correlations against brute force."""
+
+import numpy as np
+import pytest
+
+from pydendro.crossdate import lag_scan, crossdate, correlations, pair_index, squareform
+from pydendro.matrix import RingWidthMatrix
+from pydendro.sample import Sample
+
+
+def pearson(a, b):
+  """Overlap count and correlation of the pairs of *a* and *b* without NaNs."""
+
+  both = ~np.isnan(a) & ~np.isnan(b)
+  if both.sum() < 3 or np.ptp(a[both]) == 0 or np.ptp(b[both]) == 0:
+    return both.sum(), np.nan
+  return both.sum(), np.corrcoef(a[both], b[both])[0,1]
+
+
+def random_series(rng, n, gaps=0.1):
+  x = rng.uniform(0.2, 3.0, n)
+  x[rng.uniform(size=n) < gaps] = np.nan
+  return x
+
+
+@pytest.mark.parametrize('n, m', [ (60, 90), (90, 60), (1, 5), (40, 40) ])
+def test_lag_scan_brute_force(n, m):
+  rng = np.random.RandomState(n + m)
+  x, y = random_series(rng, n), random_series(rng, m)
+  min_overlap = 10
+
+  lags, overlap, r, t = lag_scan(x, y, min_overlap)
+  assert np.array_equal(lags, np.arange(-(n-1), m))
+
+  for lag, count, rr, tt in zip(lags, overlap, r, t):
+    # x[i] is paired with y[i+lag]
+    i = np.arange(max(0, -lag), min(n, m - lag))
+    expected_count, expected_r = pearson(x[i], y[i + lag])
+    assert count == expected_count
+    if expected_count < min_overlap or np.isnan(expected_r):
+      assert np.isnan(rr) and np.isnan(tt)
+    else:
+      assert abs(rr - expected_r) < 1e-10
+      assert abs(tt - expected_r * np.sqrt((count - 2) / (1 - expected_r**2))) < 1e-8
+
+
+def test_lag_scan_min_overlap():
+  rng = np.random.RandomState(3)
+  x, y = random_series(rng, 30, 0), random_series(rng, 30, 0)
+
+  for min_overlap in (0, 3, 10, 30, 31):
+    lags, overlap, r, t = lag_scan(x, y, min_overlap)
+    assert np.array_equal(np.isnan(r), overlap < max(min_overlap, 3))
+    assert np.array_equal(np.isnan(t), np.isnan(r))
+
+
+def test_crossdate_finds_shift():
+  rng = np.random.RandomState(4)
+  base = rng.uniform(0.2, 3.0, 300)
+  reference = Sample('MASTER', 1700, base)
+  sample = Sample('S1', 1790, base[120:200] + rng.normal(scale=0.05, size=80))
+
+  best = crossdate(sample, reference)[0]
+  assert (best.shift, best.first_year, best.overlap) == (30, 1820, 80)
+
+
+def random_samples(rng, count):
+  samples = []
+  for k in range(count):
+    n = rng.randint(1, 80)
+    samples.append(Sample('S%03d' % k, 1900 + rng.randint(-40, 40), random_series(rng, n)))
+  # constant series have no correlation
+  samples.append(Sample('FLAT', 1900, np.ones(50)))
+  return samples
+
+
+def test_correlations_brute_force():
+  rng = np.random.RandomState(5)
+  samples = random_samples(rng, 25)
+  min_overlap = 15
+
+  result = correlations(samples, min_overlap=min_overlap, workers=1)
+  data = RingWidthMatrix(samples).data
+  n = len(samples)
+  assert result.names == [ sample.name for sample in samples ]
+
+  for i in range(n):
+    for j in range(i+1, n):
+      count, r = pearson(data[:,i], data[:,j])
+      k = pair_index(i, j, n)
+      assert result.overlap[k] == count
+      if count < min_overlap or np.isnan(r):
+        assert np.isnan(result.r[k])
+      else:
+        assert abs(result.r[k] - r) < 1e-10
+
+  square = squareform(result.r, n, diagonal=1.0)
+  assert np.array_equal(square, square.T, equal_nan=True)
+
+
+def test_correlations_min_overlap():
+  rng = np.random.RandomState(6)
+  samples = random_samples(rng, 20)
+
+  result = correlations(samples, min_overlap=0, workers=1)
+  for min_overlap in (3, 20, 60, 1000):
+    masked = correlations(samples, min_overlap=min_overlap, workers=1)
+    assert np.array_equal(masked.overlap, result.overlap)
+    short = result.overlap < min_overlap
+    assert np.isnan(masked.r[short]).all()
+    assert np.array_equal(masked.r[~short], result.r[~short], equal_nan=True)
+
+
+def test_correlations_tiles_and_pool():
+  rng = np.random.RandomState(7)
+  samples = random_samples(rng, 23)
+
+  whole = correlations(samples, min_overlap=10, workers=1)
+  tiled = correlations(samples, min_overlap=10, workers=1, tile=4)
+  pooled = correlations(samples, min_overlap=10, workers=2, tile=4)
+
+  assert np.array_equal(tiled.overlap, pooled.overlap)
+  assert np.array_equal(tiled.r, pooled.r, equal_nan=True)
+
+  assert np.array_equal(whole.overlap, tiled.overlap)
+  assert np.array_equal(np.isnan(whole.r), np.isnan(tiled.r))
+  assert np.allclose(whole.r, tiled.r, rtol=0, atol=1e-12, equal_nan=True)
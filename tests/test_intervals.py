@@ -0,0 +1,64 @@
+"""Tests of the interval index against brute force."""
+
+import random
+
+import pytest
+
+from pydendro.intervals import IntervalIndex
+
+
+def check(index, intervals, rng):
+  for _ in range(20):
+    first = rng.randint(-200, 2200)
+    last  = first + rng.randint(0, 60)
+
+    assert sorted(index.overlapping(first, last)) == sorted(
+      name for name, (a, b) in intervals.items() if a <= last and b >= first)
+    assert sorted(index.spanning(first, last)) == sorted(
+      name for name, (a, b) in intervals.items() if a <= first and b >= last)
+    assert sorted(index.covering(first)) == sorted(
+      name for name, (a, b) in intervals.items() if a <= first <= b)
+
+  if intervals:
+    assert index.extent() == (min(a for a, b in intervals.values()),
+                              max(b for a, b in intervals.values()))
+  else:
+    assert index.extent() is None
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_queries(seed):
+  rng = random.Random(seed)
+  index, intervals = IntervalIndex(), {}
+
+  for _ in range(300):
+    name = 'S%03d' % rng.randint(0, 80)
+    if name in intervals and rng.random() < 0.3:
+      index.remove(name)
+      del intervals[name]
+    else:
+      first = rng.randint(-100, 2000)
+      # mostly short series, a few very long ones and some empty ones
+      length = rng.choice([ rng.randint(0, 400), rng.randint(0, 8000), -1 ])
+      index.add(name, first, first + length)
+      intervals[name] = (first, first + length)
+
+    assert len(index) == len(intervals)
+    check(index, intervals, rng)
+
+  for name in list(intervals):
+    index.remove(name)
+    del intervals[name]
+  check(index, intervals, rng)
+
+
+def test_long_interval():
+  index = IntervalIndex()
+  for k in range(100):
+    index.add('S%03d' % k, 1800 + k, 1850 + k)
+  index.add('MASTER', -6000, 2000)
+
+  assert sorted(index.covering(1801)) == [ 'MASTER', 'S000', 'S001' ]
+  assert index.spanning(1700, 1900) == [ 'MASTER' ]
+  assert index.extent() == (-6000, 2000)
+  assert index['MASTER'] == (-6000, 2000)
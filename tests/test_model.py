@@ -0,0 +1,19 @@
+"""Tests of the PyDendro model."""
+
+from pydendro.sample import Sample
+from pydendro.ui.model import PyDendroModel, SAMPLES_SHIFTED
+
+
+def test_shift_samples_generator():
+  model = PyDendroModel()
+  for name in ('A', 'B', 'C'):
+    model.add_sample(Sample(name, 1900, [ 1.0, 2.0, 3.0 ]))
+
+  events = []
+  model.events.connect(events.extend)
+  model.shift_samples((name for name in ('A', 'C')), 5)
+
+  assert [ (event.kind, event.ids) for event in events ] == [ (SAMPLES_SHIFTED, frozenset([ 'A', 'C' ])) ]
+  assert model.get_sample('A').fyog == 1905
+  assert model.get_sample('B').fyog == 1900
+  assert sorted(model.intervals.covering(1907)) == [ 'A', 'C' ]
@@ -0,0 +1,82 @@
+"""Tests of the negative exponential growth curves."""
+
+import numpy as np
+
+from pydendro.normalize import negative_exponential_curves, linear_curves
+
+
+def best_sse(y, t):
+  """Smallest sum of squared residuals of a exp(-b t) + k over a fine grid of b."""
+
+  best = np.inf
+  for b in np.exp(np.linspace(np.log(1e-6), np.log(10.0), 4001)):
+    X = np.column_stack((np.exp(-b*t), np.ones_like(t)))
+    coef, _, _, _ = np.linalg.lstsq(X, y, rcond=None)
+    best = min(best, np.sum((X.dot(coef) - y)**2))
+  return best
+
+
+def test_exact_curves():
+  t = np.arange(120, dtype=np.float64)
+  rws = np.column_stack([ a*np.exp(-b*t) + k
+                          for a, b, k in [ (3.0, 0.05, 0.5), (1.0, 0.01, 0.2), (8.0, 0.3, 1.0) ] ])
+
+  curves = negative_exponential_curves(rws)
+  assert np.allclose(curves, rws, rtol=1e-6, atol=0)
+
+
+def test_least_squares():
+  rng = np.random.RandomState(0)
+  t = np.arange(90, dtype=np.float64)
+  rws = np.column_stack([ 2.0*np.exp(-b*t) + 0.4 + rng.normal(scale=0.1, size=len(t))
+                          for b in (0.02, 0.05, 0.1, 0.2) ])
+
+  curves = negative_exponential_curves(rws)
+  for j in range(rws.shape[1]):
+    sse = np.sum((curves[:,j] - rws[:,j])**2)
+    assert sse <= best_sse(rws[:,j], t) * (1 + 1e-6)
+
+
+def test_batch_matches_single():
+  rng = np.random.RandomState(1)
+  rws = np.full((100, 6), np.nan)
+  for j, (top, n) in enumerate([ (0, 100), (30, 60), (95, 3), (98, 2), (40, 45), (10, 80) ]):
+    t = np.arange(n, dtype=np.float64)
+    rws[top:top+n,j] = 1.5*np.exp(-0.04*t) + 0.3 + rng.normal(scale=0.05, size=n)
+  rws[[50, 51, 70],0] = np.nan              # gaps inside a series
+  rws[60,5] = np.nan
+
+  # sums over a taller batch round differently, which can steer the
+  # search to a slightly different point of the same minimum
+  curves = negative_exponential_curves(rws)
+  assert np.array_equal(np.isnan(curves), np.isnan(rws))
+  for j in range(rws.shape[1]):
+    assert np.allclose(negative_exponential_curves(rws[:,j]), curves[:,j],
+                       rtol=1e-6, atol=0, equal_nan=True)
+
+
+def test_gaps_are_ignored():
+  rng = np.random.RandomState(2)
+  t = np.arange(70, dtype=np.float64)
+  y = 2.0*np.exp(-0.06*t) + 0.5 + rng.normal(scale=0.05, size=len(t))
+  gappy = y.copy()
+  gappy[[10, 11, 12, 40]] = np.nan
+
+  curve = negative_exponential_curves(gappy)
+  ok = ~np.isnan(gappy)
+  sse = np.sum((curve[ok] - y[ok])**2)
+  assert sse <= best_sse(y[ok], t[ok]) * (1 + 1e-6)
+
+
+def test_fallback_to_lines():
+  t = np.arange(40, dtype=np.float64)
+  rws = np.full((40, 3), np.nan)
+  rws[:,0] = 1.0 + 0.02*t                   # growing: no decaying curve fits
+  rws[38:,1] = [ 2.0, 1.0 ]                 # too short to fit
+  rws[:,2] = 3.0 - 0.05*t                   # straight line
+
+  curves = negative_exponential_curves(rws)
+  lines = linear_curves(rws)
+  assert np.allclose(curves[:,0], lines[:,0])
+  assert np.allclose(curves[38:,1], lines[38:,1])
+  assert np.allclose(curves[:,2], rws[:,2], rtol=0, atol=1e-3)
@@ -0,0 +1,385 @@
+"""Round trip tests of the RWL writer."""
+
+import math
+import os
+import random
+import tempfile
+
+import numpy as np
+import pytest
+
+import pydendro.rwl as rwl
+
+from pydendro.sample import Sample
+
+
+def round_py2(x):
+  """Round half away from zero, as round() does in Python 2."""
+
+  return math.copysign(math.floor(abs(x) + 0.5), x) if abs(x) % 1 == 0.5 else round(x)
+
+
+def old_write(filename, samples, digits=4):
+  """The RWL writer before it was vectorized (reference output), with
+  the rounding of Python 2.
+  """
+
+  samples = sorted(samples, key=lambda x: x.name)
+
+  with open(filename, 'wb') as f:
+    for sample in samples:
+      name, fyog, rws = sample.name, sample.fyog, list(sample.widths)
+
+      # append marker year
+      rws = rws + [ 9999.0/10.0**(digits-1) ]
+
+      line = "%-6s  %4d" % (name, fyog)
+      for i, year in enumerate(range(fyog, fyog+len(rws))):
+        line += "%6d" % int(round_py2(rws[i]*10**(digits-1)))
+        if ((year+1) % 10 == 0) and (i < len(rws)-1):
+          f.write((line + "\r\n").encode('ascii'))
+          line = "%-6s  %4d" % (name, year+1)
+
+      f.write((line + "\r\n").encode('ascii'))
+
+
+def check_write(tmpdir, samples, digits):
+  new = os.path.join(str(tmpdir), 'new.rwl')
+  old = os.path.join(str(tmpdir), 'old.rwl')
+
+  rwl.write(new, samples, digits=digits)
+  old_write(old, samples, digits=digits)
+
+  with open(new, 'rb') as f:
+    new_bytes = f.read()
+  with open(old, 'rb') as f:
+    old_bytes = f.read()
+
+  assert new_bytes == old_bytes
+  return new
+
+
+def random_samples(rng, digits, count=20):
+
+  # widths are multiples of the resolution of the file, up to what
+  # fits in 6 columns
+  top = 99999 / 10.0**(digits-1)
+
+  samples = []
+  for k in range(count):
+    name = 'S%05d' % k
+    fyog = rng.randint(-999, 2020)
+    nyears = rng.randint(1, 60)
+    widths = [ rng.randint(0, int(top * 10**(digits-1))) / 10.0**(digits-1)
+               for _ in range(nyears) ]
+    samples.append(Sample(name, fyog, widths))
+  return samples
+
+
+@pytest.mark.parametrize('digits', [ 2, 3, 4, 5 ])
+def test_write_matches_old_writer(tmpdir, digits):
+  rng = random.Random(digits)
+  for _ in range(20):
+    check_write(tmpdir, random_samples(rng, digits), digits)
+
+
+@pytest.mark.parametrize('digits', [ 2, 3, 4, 5 ])
+def test_read_write_round_trip(tmpdir, digits):
+  rng = random.Random(100 + digits)
+  for _ in range(20):
+    samples  = random_samples(rng, digits)
+    filename = check_write(tmpdir, samples, digits)
+
+    read = dict((sample.name, sample) for sample in rwl.read(filename, digits=digits))
+    assert sorted(read) == sorted(sample.name for sample in samples)
+    for sample in samples:
+      assert read[sample.name].fyog == sample.fyog
+      assert np.allclose(read[sample.name].widths, sample.widths, rtol=0, atol=1e-9)
+
+
+def test_negative_years(tmpdir):
+  samples = [ Sample('NEG01', -25, [ 0.1*k for k in range(40) ]),
+              Sample('NEG02', -1, [ 1.0, 2.0 ]),
+              Sample('NEG03', -999, [ 0.5 ]*12) ]
+  filename = check_write(tmpdir, samples, 4)
+
+  read = dict((sample.name, sample) for sample in rwl.read(filename))
+  for sample in samples:
+    assert read[sample.name].fyog == sample.fyog
+    assert np.allclose(read[sample.name].widths, sample.widths)
+
+
+@pytest.mark.parametrize('name', [ 'ABCDEF', 'ABCDEFG', 'ABCDEFGH' ])
+def test_long_names(tmpdir, name):
+  samples = [ Sample(name, 1901, [ 1.0, 2.0, 3.0 ]*5) ]
+  filename = check_write(tmpdir, samples, 4)
+
+  read = rwl.read(filename)
+  assert [ sample.name for sample in read ] == [ name ]
+  assert read[0].fyog == 1901
+  assert np.allclose(read[0].widths, samples[0].widths)
+
+
+def test_empty_series(tmpdir):
+  samples = [ Sample('EMPTY', 1900, []), Sample('FULL', 1900, [ 1.0, 2.0 ]) ]
+  check_write(tmpdir, samples, 4)
+
+
+@pytest.mark.parametrize('digits', [ 2, 3, 4, 5 ])
+def test_half_way_rounding(tmpdir, digits):
+  # exactly representable values half way between two integers
+  half = [ (k + 0.5) / 10.0**(digits-1) for k in range(-3, 40) ]
+  half = [ w for w in half if float(w * 10**(digits-1)) == int(w * 10**(digits-1) * 2) / 2.0 ]
+  samples = [ Sample('HALF', 1950, half) ]
+  check_write(tmpdir, samples, digits)
+
+
+def test_half_way_rounds_away_from_zero():
+  sample = Sample('HALF', 1950, [ 0.5, 1.5, 2.5, -0.5, -2.5, 0.49999999999999994 ])
+  assert rwl.format_sample(sample, digits=1) == \
+    'HALF    1950     1     2     3    -1    -3     0  9999\r\n'
+
+
+def outcome(reader):
+  """Return the samples read by *reader* as plain tuples, or the error raised."""
+
+  try:
+    return [ (sample.name, sample.fyog, list(sample.widths)) for sample in reader() ]
+  except ValueError:
+    return ValueError
+
+
+def check_read(tmpdir, lines, newline='\n', digits=None, fixed=None):
+  """Check that the fast reader gives exactly what the tolerant reader gives.
+
+  If *fixed* is given, also check whether the fast path decoded the
+  file itself (True) or had to defer to the tolerant reader (False).
+  """
+
+  filename = os.path.join(str(tmpdir), 'case.rwl')
+  with open(filename, 'wb') as f:
+    f.write(newline.join(lines).encode('ascii'))
+
+  expected = outcome(lambda: rwl.iter_samples(filename, digits=digits))
+  assert outcome(lambda: rwl.read(filename, digits=digits)) == expected
+
+  if fixed is not None:
+    with open(filename, 'rb') as f:
+      data = f.read()
+    try:
+      rwl._read_fixed(data, digits)
+      decoded = True
+    except rwl._NotFixed:
+      decoded = False
+    assert decoded == fixed
+
+  return expected
+
+
+def record(name, year, widths):
+  """Return a fixed-width RWL line."""
+
+  return '%-8s%4d' % (name, year) + ''.join('%6d' % w for w in widths)
+
+
+SERIES = [ record('ABC001', 1895, [ 120, 131, 98, 77, 145 ]),
+           record('ABC001', 1900, [ 101, 99, 87, 112, 130, 119, 94, 88, 76, 81 ]),
+           record('ABC001', 1910, [ 66, 71, 999 ]),
+           record('ABC002', 1901, [ 1203, 1122, 990, 1001, 1450, 1302, 1111, 1095, 999 ]),
+           record('ABC002', 1910, [ 1210, -9999 ]) ]
+
+
+@pytest.mark.parametrize('newline', [ '\n', '\r\n' ])
+def test_read_fixed_endings(tmpdir, newline):
+  samples = check_read(tmpdir, SERIES, newline, fixed=True)
+  assert [ sample[0] for sample in samples ] == [ 'ABC001', 'ABC002' ]
+  check_read(tmpdir, SERIES + [ '' ], newline, fixed=True)
+
+
+def test_read_cr_endings(tmpdir):
+  check_read(tmpdir, SERIES, '\r')
+  check_read(tmpdir, SERIES + [ '' ], '\r')
+
+
+@pytest.mark.parametrize('gap', [ '', '    ', '\t' ])
+def test_read_blank_lines(tmpdir, gap):
+  for newline in ('\n', '\r\n'):
+    check_read(tmpdir, [ gap ] + SERIES[:3] + [ gap, gap ] + SERIES[3:] + [ gap ], newline)
+    check_read(tmpdir, SERIES[:1] + [ gap ] + SERIES[1:], newline)
+
+
+def test_read_tabs(tmpdir):
+  check_read(tmpdir, SERIES[:1] + [ 'ABC001\t1900\t101\t99\t87\t999' ] + SERIES[3:])
+  check_read(tmpdir, [ line.replace('  ', '\t') for line in SERIES ])
+
+
+def test_read_loose_lines(tmpdir):
+  # lines that are not in the fixed layout are split by the tolerant parser
+  loose = [ 'ABC001 1900 101 99 87 112 130 119 94 88 76 81',
+            'ABC001    1900   101    99',
+            'ABC001  1900  1011    99    87   999',
+            'ABC001  1900   101    99    87   999 ' ]
+  for line in loose:
+    for newline in ('\n', '\r\n'):
+      check_read(tmpdir, SERIES[:1] + [ line ] + SERIES[2:], newline, fixed=True)
+      check_read(tmpdir, [ line ] + SERIES, newline)
+      check_read(tmpdir, SERIES + [ line ], newline)
+
+
+@pytest.mark.parametrize('name', [ 'ABCDEFG', 'ABCDEFGH', 'AB', 'AB CD' ])
+def test_read_name_lengths(tmpdir, name):
+  lines = [ record(name, 1901, [ 101, 102, 103, 104, 105, 106, 107, 108, 109 ]),
+            record(name, 1910, [ 110, 111, 999 ]),
+            record(name[:-1] + 'X', 1901, [ 201, 999 ]) ]
+  check_read(tmpdir, lines, fixed=' ' not in name)
+  check_read(tmpdir, lines[:1] + lines[2:] + lines[1:2])
+
+
+def test_read_negative_years(tmpdir):
+  lines = [ record('NEG01', -25, [ 12, 13, 14, 15, 16 ]),
+            record('NEG01', -20, [ 17, 18, 19, 20, 21, 22, 23, 24, 25, 26 ]),
+            record('NEG01', -10, [ 27, -9999 ]),
+            record('NEG02', -999, [ 5, 999 ]) ]
+  check_read(tmpdir, lines, fixed=True)
+
+
+def test_read_header_lines(tmpdir):
+  header = [ 'ABC      1 Some Site                                          PSME',
+             'ABC      2 Some State     Douglas-fir        1234M  4500  12000   __    1895 1911',
+             'ABC      3 Some Investigator                                  1895 1911' ]
+  assert check_read(tmpdir, header + SERIES) is ValueError
+  assert check_read(tmpdir, header[:1] + SERIES) is ValueError
+
+  # numeric header lines read as (odd) records by both readers
+  header = [ 'ABC      1  1895  1911', 'ABC      2   120   -99' ]
+  for newline in ('\n', '\r\n'):
+    assert len(check_read(tmpdir, header + SERIES, newline)) == 3
+
+
+def test_read_missing_end_marker(tmpdir):
+  check_read(tmpdir, SERIES[:2], fixed=True)
+  check_read(tmpdir, SERIES[:2] + SERIES[3:], fixed=True)
+  check_read(tmpdir, SERIES[:2] + [ '' ], fixed=True)
+
+
+def test_read_malformed(tmpdir):
+  check_read(tmpdir, SERIES[:1] + [ 'ABC001  1900   101    x9   999' ] + SERIES[2:])
+  check_read(tmpdir, SERIES[:1] + [ 'ABC001  19x0   101    99   999' ] + SERIES[2:])
+  check_read(tmpdir, SERIES[:1] + [ 'ABC001  1900' ] + SERIES[2:])
+
+
+@pytest.mark.parametrize('digits', [ None, 2, 3, 4, 5 ])
+def test_read_fast_matches_tolerant(tmpdir, digits):
+  rng = random.Random(200 + (digits or 0))
+  for _ in range(10):
+    samples  = random_samples(rng, digits or 3)
+    filename = os.path.join(str(tmpdir), 'random.rwl')
+    rwl.write(filename, samples, digits=digits or 3)
+    with open(filename, 'rb') as f:
+      lines = f.read().decode('ascii').split('\r\n')
+    check_read(tmpdir, lines, '\r\n', digits=digits, fixed=True)
+    check_read(tmpdir, lines, '\n', digits=digits, fixed=True)
+
+
+def patch_case(tmpdir, rng):
+  """Write random samples to a file with an up to date index."""
+
+  from pydendro.rwlindex import IndexedRWL
+
+  samples  = random_samples(rng, 4)
+  filename = os.path.join(str(tmpdir), 'patch.rwl')
+  rwl.write(filename, samples)
+  with IndexedRWL(filename) as saved:
+    assert len(saved) == len(samples)
+
+  return filename, samples
+
+
+def check_patch(monkeypatch, filename, samples, changed, in_place):
+  """Patch *changed* into *filename* and compare with a full write.
+
+  *in_place* tells whether the patch should write into the file rather
+  than copy it to a temporary file.
+  """
+
+  from pydendro.rwlindex import IndexedRWL
+
+  copies = []
+  def mkstemp(*args):
+    copies.append(args)
+    return tempfile.mkstemp(*args)
+  monkeypatch.setattr(rwl, 'mkstemp', mkstemp)
+  rwl.patch(filename, changed)
+  monkeypatch.undo()
+  assert (not copies) == in_place
+
+  merged = dict((sample.name, sample) for sample in samples)
+  merged.update((sample.name, sample) for sample in changed)
+  full = filename + '.full'
+  rwl.write(full, merged.values())
+
+  with open(filename, 'rb') as f:
+    patched = f.read()
+  with open(full, 'rb') as f:
+    assert patched == f.read()
+
+  # the sidecar is up to date and matches a freshly built index
+  with IndexedRWL(filename, sidecar=False) as fresh:
+    with IndexedRWL(filename) as indexed:
+      assert indexed._load_index() is not None
+      assert indexed._index == fresh._index
+
+  assert rwl.changed_samples(filename, list(merged.values())) == []
+
+
+def edited(sample, widths=None, fyog=None):
+  return Sample(sample.name, sample.fyog if fyog is None else fyog,
+                sample.widths if widths is None else widths)
+
+
+def test_patch_in_place(tmpdir, monkeypatch):
+  rng = random.Random(300)
+  filename, samples = patch_case(tmpdir, rng)
+
+  # same years, so the lines keep their length
+  changed = [ edited(sample, widths=sample.widths[::-1]) for sample in samples[::3] ]
+  check_patch(monkeypatch, filename, samples, changed, True)
+
+
+def test_patch_spliced(tmpdir, monkeypatch):
+  rng = random.Random(301)
+  filename, samples = patch_case(tmpdir, rng)
+
+  changed = [ edited(samples[1], fyog=samples[1].fyog + 7),
+              edited(samples[4], widths=list(samples[4].widths) + [ 1.0, 2.0 ]),
+              edited(samples[7], widths=samples[7].widths[:1]),
+              edited(samples[-1], widths=[]) ]
+  assert rwl.changed_samples(filename, samples) == []
+  check_patch(monkeypatch, filename, samples, changed, False)
+
+
+def test_patch_appended(tmpdir, monkeypatch):
+  rng = random.Random(302)
+  filename, samples = patch_case(tmpdir, rng)
+
+  changed = [ Sample('Z%05d' % k, 1800 + k, [ 0.5 ]*(k+1)) for k in range(3) ]
+  changed.append(edited(samples[2], fyog=samples[2].fyog - 3))
+  check_patch(monkeypatch, filename, samples, changed, False)
+
+
+def test_changed_samples(tmpdir):
+  rng = random.Random(303)
+  filename, samples = patch_case(tmpdir, rng)
+
+  assert rwl.changed_samples(filename, samples) == []
+
+  update = list(samples)
+  update[3] = edited(samples[3], fyog=samples[3].fyog + 1)
+  update[5] = edited(samples[5], widths=np.asarray(samples[5].widths) + 0.001)
+  update[6] = edited(samples[6])
+  assert rwl.changed_samples(filename, update) == [ update[3], update[5] ]
+
+  # a different set of samples has to be written in full
+  assert rwl.changed_samples(filename, samples[1:]) is None
+  assert rwl.changed_samples(filename, samples + [ Sample('NEW', 1900, [ 1.0 ]) ]) is None
+  assert rwl.changed_samples(filename + '.missing', samples) is None
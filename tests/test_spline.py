@@ -0,0 +1,103 @@
+"""Tests of the batched smoothing spline against dense solves."""
+
+import numpy as np
+import pytest
+
+from pydendro.spline import solve_pentadiagonal, smooth, spline_curves, stiffness
+
+
+def dense_smooth(y, p):
+  """Reference smoothing spline: g = (I + p Q R^-1 Q')^-1 y (Reinsch, 1967)."""
+
+  n = len(y)
+  if n < 3:
+    return np.array(y, dtype=np.float64)
+
+  Q = np.zeros((n, n-2))
+  R = np.zeros((n-2, n-2))
+  for j in range(n-2):
+    Q[j:j+3,j] = [ 1.0, -2.0, 1.0 ]
+    R[j,j] = 2.0/3
+    if j < n-3:
+      R[j,j+1] = R[j+1,j] = 1.0/6
+
+  return np.linalg.solve(np.eye(n) + p * Q.dot(np.linalg.solve(R, Q.T)), y)
+
+
+def test_solve_pentadiagonal():
+  rng = np.random.RandomState(0)
+  for n in (1, 2, 3, 4, 7, 30):
+    k = 5
+    d = rng.uniform(4, 8, (n, k))
+    e = rng.uniform(-1, 1, (n, k))
+    f = rng.uniform(-1, 1, (n, k))
+    b = rng.normal(size=(n, k))
+
+    x = solve_pentadiagonal(d, e, f, b)
+    for j in range(k):
+      A = np.diag(d[:,j])
+      for i in range(n-1):
+        A[i,i+1] = A[i+1,i] = e[i,j]
+      for i in range(n-2):
+        A[i,i+2] = A[i+2,i] = f[i,j]
+      assert np.allclose(x[:,j], np.linalg.solve(A, b[:,j]), rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('n', [ 1, 2, 3, 4, 5, 50, 200 ])
+def test_smooth_matches_dense(n):
+  rng = np.random.RandomState(n)
+  y = np.cumsum(rng.normal(size=n)) + 10
+  for p in (1e-3, 1.0, 1e3):
+    g = smooth(y[:,None], np.array([ n ]), np.array([ p ]))[:,0]
+    assert np.allclose(g, dense_smooth(y, p), rtol=0, atol=1e-9)
+
+
+def test_smooth_mixed_lengths():
+  rng = np.random.RandomState(1)
+  lengths = np.array([ 1, 2, 3, 4, 17, 60, 33 ])
+  p = stiffness(np.maximum(0.67 * lengths, 2.0))
+
+  y = rng.normal(size=(lengths.max(), len(lengths))) + 5
+  g = smooth(y, lengths, p)
+
+  for j, n in enumerate(lengths):
+    alone = smooth(y[:n,j:j+1], lengths[j:j+1], p[j:j+1])[:,0]
+    assert np.array_equal(g[:n,j], alone)
+    assert np.allclose(g[:n,j], dense_smooth(y[:n,j], p[j]), rtol=0, atol=1e-9)
+
+
+def test_spline_curves_gaps_and_padding():
+  rng = np.random.RandomState(2)
+  rws = np.full((80, 4), np.nan)
+  rws[:80,0] = rng.uniform(0.5, 2, 80)
+  rws[10:50,1] = rng.uniform(0.5, 2, 40)
+  rws[77:,2] = rng.uniform(0.5, 2, 3)
+  rws[5:70,3] = rng.uniform(0.5, 2, 65)
+  rws[[20, 21, 22, 40],3] = np.nan          # gaps inside the series
+
+  curves = spline_curves(rws)
+  assert np.array_equal(np.isnan(curves), np.isnan(rws))
+
+  # each column is fitted as if on its own
+  for j in range(rws.shape[1]):
+    assert np.allclose(spline_curves(rws[:,j]), curves[:,j], rtol=0, atol=1e-12, equal_nan=True)
+
+  # gaps are filled by linear interpolation for the fit
+  y = rws[5:70,3].copy()
+  inside = np.flatnonzero(~np.isnan(y))
+  y = np.interp(np.arange(len(y)), inside, y[inside])
+  expected = dense_smooth(y, stiffness(0.67 * len(y)))
+  ok = ~np.isnan(rws[5:70,3])
+  assert np.allclose(curves[5:70,3][ok], expected[ok], rtol=0, atol=1e-9)
+
+
+def test_spline_curves_short_series():
+  rws = np.full((3, 3), np.nan)
+  rws[2,0] = 1.5
+  rws[1:,1] = [ 1.0, 2.0 ]
+  rws[:,2] = [ 1.0, 3.0, 2.0 ]
+
+  curves = spline_curves(rws)
+  assert np.array_equal(curves[2:,0], [ 1.5 ])
+  assert np.array_equal(curves[1:,1], [ 1.0, 2.0 ])
+  assert np.allclose(curves[:,2], dense_smooth(rws[:,2], stiffness(2.01)), rtol=0, atol=1e-12)